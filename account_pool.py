@@ -0,0 +1,157 @@
+"""
+Несколько аккаунтов Telegram с распределением чатов.
+
+Чаты распределяются между аккаунтами консистентным хешированием: у
+каждого аккаунта много виртуальных точек на кольце, чат принадлежит
+первому доступному аккаунту по часовой стрелке от хеша своей ссылки.
+Если аккаунт получил долгий FloodWait или потерял сессию (бан, отзыв
+ключа), его чаты переходят к следующим аккаунтам на кольце, а чаты
+остальных аккаунтов не перемещаются. После окончания FloodWait чаты
+возвращаются владельцу. Аккаунт, который не состоит в чате (обновления
+из него не придут), для этого чата пропускается.
+"""
+
+import bisect
+import hashlib
+import logging
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from telethon.errors import rpcerrorlist
+
+log = logging.getLogger("tg-scout")
+
+# Ошибки, после которых сессия аккаунта непригодна
+ACCOUNT_LOST_ERRORS = (
+    rpcerrorlist.UserDeactivatedBanError,
+    rpcerrorlist.UserDeactivatedError,
+    rpcerrorlist.AuthKeyUnregisteredError,
+    rpcerrorlist.AuthKeyDuplicatedError,
+    rpcerrorlist.SessionRevokedError,
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными точками"""
+
+    def __init__(self, names: Iterable[str], replicas: int = 100):
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._names = [name for _, name in points]
+
+    def owners(self, key: str) -> Iterator[str]:
+        """Аккаунты в порядке обхода кольца от хеша ключа (без повторов)"""
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = set()
+        for i in range(len(self._names)):
+            name = self._names[(start + i) % len(self._names)]
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+
+class Account:
+    """Сессия Telegram: клиент, кэш сущностей, ограничитель отправки и состояние"""
+
+    def __init__(self, name: str, client, entities, limiter):
+        self.name = name
+        self.client = client
+        self.entities = entities
+        self.limiter = limiter
+        self.available_at = 0.0
+        self.lost = None
+
+    def available(self, now: float = None) -> bool:
+        return self.lost is None and (now or time.monotonic()) >= self.available_at
+
+    def __repr__(self) -> str:
+        return f"Account({self.name!r})"
+
+
+class AccountPool:
+    """Аккаунты и принадлежность им чатов"""
+
+    def __init__(self, accounts: List[Account], replicas: int = 100):
+        if not accounts:
+            raise ValueError("нужен хотя бы один аккаунт")
+        self.accounts = accounts
+        self._by_name: Dict[str, Account] = {a.name: a for a in accounts}
+        self._ring = HashRing(self._by_name, replicas)
+        # Ключ -> аккаунты, которые не состоят в чате или не могут его открыть
+        self._excluded: Dict[str, set] = {}
+
+    @property
+    def primary(self) -> Account:
+        """Основной аккаунт: через него идут карточки и уведомления"""
+        return self.accounts[0]
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def get(self, name: str) -> Optional[Account]:
+        return self._by_name.get(name)
+
+    def by_client(self, client) -> Optional[Account]:
+        for account in self.accounts:
+            if account.client is client:
+                return account
+        return None
+
+    def owner(self, key: str) -> Optional[Account]:
+        """
+        Первый доступный аккаунт на кольце, состоящий в чате; если в чате
+        нет ни одного — первый доступный. Если все на FloodWait — тот,
+        что освободится раньше; если все потеряны — None
+        """
+        now = time.monotonic()
+        candidates = [self._by_name[name] for name in self._ring.owners(key)]
+        excluded = self._excluded.get(key, ())
+        for account in candidates:
+            if account.available(now) and account.name not in excluded:
+                return account
+        for account in candidates:
+            if account.available(now):
+                return account
+        alive = [a for a in candidates if a.lost is None]
+        return min(alive, key=lambda a: a.available_at) if alive else None
+
+    def shard(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """Ключи по аккаунтам-владельцам"""
+        shards: Dict[str, List[str]] = {}
+        for key in keys:
+            account = self.owner(key)
+            if account is not None:
+                shards.setdefault(account.name, []).append(key)
+        return shards
+
+    def exclude(self, key: str, account: Account):
+        """Аккаунт не состоит в чате key: чат достается следующему на кольце"""
+        self._excluded.setdefault(key, set()).add(account.name)
+
+    def mark_flooded(self, account: Account, seconds: float):
+        """Аккаунт недоступен seconds секунд"""
+        account.available_at = max(account.available_at, time.monotonic() + seconds)
+        if len(self) > 1:
+            log.warning(f"🚧 Аккаунт {account.name}: FloodWait {seconds} с, его чаты переходят другим")
+
+    def mark_lost(self, account: Account, reason):
+        """Сессия аккаунта непригодна до перезапуска"""
+        if account.lost is None:
+            account.lost = str(reason)
+            log.error(f"⛔ Аккаунт {account.name} отключен: {reason}")
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [{
+            'name': a.name,
+            'available': a.available(now),
+            'flood_wait': round(max(0.0, a.available_at - now), 1),
+            'lost': a.lost,
+            'send_limiter': a.limiter.stats(),
+        } for a in self.accounts]
@@ -1,32 +1,50 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import re
 import json
 import asyncio
 from telethon.errors import rpcerrorlist
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import argparse
+import itertools
 import random
-import pandas as pd
 from dotenv import load_dotenv
-from telethon import TelegramClient, events
-from telethon.tl.types import Channel, Chat, User
-import requests
-from flask import Flask, jsonify
-from flask_socketio import SocketIO, emit
+from telethon import TelegramClient, events, utils
+from telethon.tl.types import Channel, Chat, PeerChannel, PeerChat
 import threading
 # Импортируем общую базу данных
 from shared_db import db
-# Импорт для WebSocket уведомлений
-import socketio
+from keyword_matcher import KeywordIndex, KeywordMatcher, live_keyword_matcher
+from account_pool import ACCOUNT_LOST_ERRORS, Account, AccountPool
+from entity_cache import EntityCache
+from lead_scoring import live_lead_scorer
+from lemmatizer import Lemmatizer, regex_tokens
+from seen_messages import SeenMessages
+from sender_cache import SenderCache
+from send_limiter import SendLimiter
+
+# Тяжелые зависимости (pandas, Flask, Flask-SocketIO, python-socketio,
+# requests, natasha) импортируются там, где они нужны, чтобы бот
+# подключался к Telegram как можно быстрее после перезапуска.
+
+# Клиент для отправки уведомлений в веб-интерфейс (создается лениво)
+sio_client = None
 
-# Создаем клиент для отправки уведомлений в веб-интерфейс
-sio_client = socketio.AsyncClient()
+def get_sio_client():
+    """Возвращает клиент python-socketio, создавая его при первом обращении"""
+    global sio_client
+    if sio_client is None:
+        import socketio
+        sio_client = socketio.AsyncClient()
+    return sio_client
 
 async def connect_to_web_interface():
     """Подключение к веб-интерфейсу для отправки уведомлений"""
     try:
-        await sio_client.connect('http://localhost:8080')
+        await get_sio_client().connect('http://localhost:8080')
         log.info("🔗 Подключен к веб-интерфейсу")
         return True
     except Exception as e:
@@ -36,7 +54,7 @@ async def connect_to_web_interface():
 async def notify_web_interface(event_type: str, data: dict):
     """Отправка уведомления в веб-интерфейс"""
     try:
-        if sio_client.connected:
+        if sio_client is not None and sio_client.connected:
             await sio_client.emit(event_type, data)
             log.verbose(f"📡 Отправлено в веб: {event_type}")
     except Exception as e:
@@ -58,6 +76,7 @@ with open("config.json", "r", encoding="utf-8") as f:
 DAYS_BACK = int(CFG.get("days_back", 1))
 MIN_LENGTH = int(CFG.get("min_length", 1))
 KW_FILE = CFG.get("keywords_file", "keywords.txt")
+NEG_KW_FILE = CFG.get("negative_keywords_file", "negative_keywords.txt")
 CHATS_FILE = CFG.get("chats_file", "chats.txt")
 SAVE_CSV = bool(CFG.get("save_csv", True))
 SAVE_JSON = bool(CFG.get("save_json", False))
@@ -73,7 +92,40 @@ ENABLE_TOGETHER_AI = bool(CFG.get("enable_together_ai", True))
 # Более точные настройки времени
 HOURS_BACK = int(CFG.get("hours_back", 24))
 MAX_MESSAGES_PER_CHAT = int(CFG.get("max_messages_per_chat", 500))
+SCAN_PAGE_SIZE = int(CFG.get("scan_page_size", 100))
+SCAN_CONCURRENCY = max(1, int(CFG.get("scan_concurrency", 5)))
+SCAN_FLOOD_RETRIES = int(CFG.get("scan_flood_retries", 3))
+# Пауза воркера доставки между лидами, секунды
+SEND_DELAY_MIN = int(CFG.get("send_delay_min", 3))
+SEND_DELAY_MAX = max(SEND_DELAY_MIN, int(CFG.get("send_delay_max", 15)))
+# Как часто бот публикует состояние отправки для /api/status, секунды
+SEND_STATS_INTERVAL = float(CFG.get("send_stats_interval", 10))
+
+def make_send_limiter() -> SendLimiter:
+    """Общий лимит исходящих сообщений аккаунта и лимит на одного получателя"""
+    return SendLimiter(
+        global_rate=float(CFG.get("send_rate_per_sec", 1.0)),
+        global_burst=int(CFG.get("send_burst", 5)),
+        per_destination_rate=float(CFG.get("send_rate_per_chat", 0.33)),
+        per_destination_burst=int(CFG.get("send_burst_per_chat", 3)),
+        max_flood_wait=float(CFG.get("send_max_flood_wait", 3600)),
+    )
+
+SEND_LIMITER = make_send_limiter()
 TIME_SEARCH_MODE = CFG.get("time_search_mode", "hours")
+# Сколько часов разрешенные чаты берутся из entity_cache без обращения к сети
+ENTITY_CACHE_TTL_HOURS = float(CFG.get("entity_cache_ttl_hours", 72))
+# Профили авторов лидов в памяти: сколько хранить и сколько минут считать свежими
+SENDER_CACHE_SIZE = int(CFG.get("sender_cache_size", 10000))
+SENDER_CACHE_TTL_MINUTES = float(CFG.get("sender_cache_ttl_minutes", 60))
+# Сессии аккаунтов в sessions/: список имен или "auto" (все файлы *.session)
+ACCOUNTS_CFG = CFG.get("accounts", ["session_one"])
+# Как часто в режиме мониторинга чаты перераспределяются между доступными аккаунтами, секунды
+ACCOUNT_REBALANCE_INTERVAL = float(CFG.get("account_rebalance_interval", 30))
+# Как часто в режиме мониторинга проверяется версия chat_sources, секунды
+CHAT_SOURCES_CHECK_INTERVAL = float(CFG.get("chat_sources_check_interval", 2))
+# Через сколько секунд снова пробовать ссылку из chat_sources, которая не разрешилась
+CHAT_SOURCES_RETRY_INTERVAL = float(CFG.get("chat_sources_retry_interval", 300))
 
 os.makedirs(EXPORT_DIR, exist_ok=True)
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -90,19 +142,42 @@ logging.basicConfig(
 )
 log = logging.getLogger("tg-scout")
 
+class StartupTimer:
+    """Замеряет фазы запуска бота и выводит сводку"""
+
+    def __init__(self, started: float):
+        self.started = self._last = started
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = self._last - self.started
+        lines = [f"   • {phase}: {seconds:.2f} с" for phase, seconds in self.phases]
+        log.info(f"⏱️ Запуск занял {total:.2f} с:\n" + "\n".join(lines))
+
+STARTUP = StartupTimer(_IMPORT_STARTED)
+
 def log_verbose(message):
     """Логирует только если включен verbose режим"""
     if VERBOSE_LOGS:
         log.info(message)
 
-# Вычисляем время поиска
+# Окно поиска отсчитывается от момента каждого сканирования
 if TIME_SEARCH_MODE == "hours":
-    DATE_FROM = datetime.now() - timedelta(hours=HOURS_BACK)
+    SEARCH_WINDOW = timedelta(hours=HOURS_BACK)
     time_desc = f"{HOURS_BACK} часов"
 else:
-    DATE_FROM = datetime.now() - timedelta(days=DAYS_BACK)
+    SEARCH_WINDOW = timedelta(days=DAYS_BACK)
     time_desc = f"{DAYS_BACK} дней"
 
+def search_window_start() -> datetime:
+    """Начало окна поиска для сканирования, начинающегося сейчас"""
+    return datetime.now() - SEARCH_WINDOW
+
 log.info(f"⏰ Режим поиска: последние {time_desc}")
 
 # Модели Together.ai
@@ -121,53 +196,99 @@ else:
 daily_replies_count = 0
 last_reset_date = datetime.now().date()
 
-# Flask приложение для API
-api_app = Flask(__name__)
-api_app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(api_app, cors_allowed_origins="*")
+# Flask приложение для API (создается в create_api_app только в режиме api)
+api_app = None
+socketio = None
 
 # ---------- клиент ----------
-client = TelegramClient(os.path.join("sessions", "session_one"), API_ID, API_HASH)
+SESSION_NAME = "session_one"
+
+def session_names() -> list:
+    """Имена сессий аккаунтов; основная сессия всегда первая"""
+    if ACCOUNTS_CFG == "auto":
+        names = sorted(f[:-len(".session")] for f in os.listdir("sessions") if f.endswith(".session"))
+    else:
+        names = [str(name) for name in ACCOUNTS_CFG]
+    return [SESSION_NAME] + [name for name in names if name != SESSION_NAME]
+
+def make_account(name: str, account_client=None, limiter=None) -> Account:
+    """Аккаунт с собственными клиентом, кэшем сущностей и ограничителем отправки"""
+    if account_client is None:
+        account_client = TelegramClient(os.path.join("sessions", name), API_ID, API_HASH,
+                                        flood_sleep_threshold=0)
+    return Account(name, account_client,
+                   EntityCache(db, name, ttl_seconds=ENTITY_CACHE_TTL_HOURS * 3600),
+                   limiter or make_send_limiter())
+
+# flood_sleep_threshold=0: Telethon не спит на FloodWait сам, а отдает ошибку
+# вызывающему коду — ограничителю отправки, сканеру и распределению чатов
+client = TelegramClient(os.path.join("sessions", SESSION_NAME), API_ID, API_HASH,
+                        flood_sleep_threshold=0)
+POOL = AccountPool([make_account(SESSION_NAME, client, SEND_LIMITER)] +
+                   [make_account(name) for name in session_names()[1:]])
 FORWARD_TARGET = None
+ENTITIES = POOL.primary.entities
+SENDERS = SenderCache(SENDER_CACHE_SIZE, ttl_seconds=SENDER_CACHE_TTL_MINUTES * 60)
 
 # WebSocket для уведомлений веб-интерфейса
 def notify_web_interface(event_type: str, data: dict):
     """Отправляет уведомление в веб-интерфейс"""
+    if socketio is None:
+        return
     try:
         socketio.emit(event_type, data)
     except Exception as e:
         log.error(f"Ошибка отправки WebSocket уведомления: {e}")
 
 # ---------- NLP: natasha (опционально) ----------
-if USE_NATASHA:
+# Модели natasha грузятся лениво — при первой лемматизации или явно
+# через load_nlp() уже после подключения к Telegram
+LEMMATIZER = Lemmatizer.from_config(CFG)
+if LEMMATIZER is not None:
+    log.info(f"📚 Кэш лемм: {LEMMATIZER.cache.stats()['disk_entries']} словоформ с диска")
+
+def load_nlp() -> bool:
+    """Загружает модели natasha (один раз). Возвращает True, если лемматизация доступна"""
+    global USE_NATASHA
+    if not USE_NATASHA:
+        return False
+    if not LEMMATIZER.load():
+        USE_NATASHA = False
+    return USE_NATASHA
+
+def normalize_tokens_batch(texts):
+    """
+    Леммы для пачки текстов: [[(лемма, start, stop), ...], ...]
+    (см. Lemmatizer.tokens_batch). Без natasha — просто слова в нижнем регистре.
+    """
+    if LEMMATIZER is None:
+        return [regex_tokens(t) for t in texts]
+    return LEMMATIZER.tokens_batch(texts)
+
+def normalize_tokens(s: str):
+    """Леммы слов текста с позициями: [(лемма, start, stop), ...]"""
+    return normalize_tokens_batch([s])[0]
+
+def save_lemma_cache():
+    """Сохраняет кэш лемм на диск для быстрого теплого старта"""
+    if not USE_NATASHA:
+        return
     try:
-        from natasha import Segmenter, MorphVocab, NewsEmbedding, NewsMorphTagger, Doc
-        from razdel import tokenize
-        SEGMENTER = Segmenter()
-        MORPH_VOCAB = MorphVocab()
-        EMB = NewsEmbedding()
-        TAGGER = NewsMorphTagger(EMB)
-        _LEMMA_CACHE = {}
-
-        def normalize_text(s: str):
-            out = []
-            for tok in tokenize(s.lower()):
-                w = tok.text
-                if w in _LEMMA_CACHE:
-                    out.append(_LEMMA_CACHE[w]); continue
-                doc = Doc(w); doc.segment(SEGMENTER); doc.tag_morph(TAGGER)
-                if doc.tokens:
-                    t = doc.tokens[0]; t.lemmatize(MORPH_VOCAB)
-                    _LEMMA_CACHE[w] = t.lemma
-                    out.append(t.lemma)
-            return out
+        saved = LEMMATIZER.cache.save()
+        stats = LEMMATIZER.cache.stats()
+        log.info(f"📚 Кэш лемм сохранен: {saved} словоформ "
+                 f"(в памяти {stats['entries']}, ~{stats['memory_bytes'] // 1024} КБ, вытеснено {stats['evictions']})")
     except Exception as e:
-        log.warning(f"Natasha не загрузилась ({e}). Перехожу в быстрый режим.")
-        USE_NATASHA = False
+        log.warning(f"⚠️ Не удалось сохранить кэш лемм: {e}")
 
-if not USE_NATASHA:
-    def normalize_text(s: str):
-        return re.findall(r"[a-zA-Zа-яА-ЯёЁ0-9#@_]+", s.lower())
+async def lemma_cache_autosave(interval: int):
+    """Периодически сохраняет кэш лемм, чтобы не потерять его при аварийной остановке"""
+    while True:
+        await asyncio.sleep(interval)
+        save_lemma_cache()
+
+def normalize_text(s: str):
+    return [lemma for lemma, _, _ in normalize_tokens(s)]
 
 # ---------- ключевые слова ----------
 def load_keywords_from_file():
@@ -183,92 +304,175 @@ def load_keywords_from_file():
                 db.add_keyword(line)
     
     log.info(f"🔋 Ключевые слова загружены из {KW_FILE}")
+    load_negative_keywords_from_file()
+
+def load_negative_keywords_from_file():
+    """Загружает исключающие фразы из файла в БД"""
+    if not os.path.exists(NEG_KW_FILE):
+        return
+    
+    with open(NEG_KW_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                db.add_negative_keyword(line)
+    
+    log.info(f"🚫 Исключающие фразы загружены из {NEG_KW_FILE}")
+
+def load_chats_from_file():
+    """
+    Добавляет чаты из файла в chat_sources. Список чатов бота — активные
+    строки chat_sources (их же меняет /api/chat-sources веб-сервера).
+    Каждая строка файла добавляется один раз: строка chat_sources потом
+    переводится на ключ чата, а удаленный или выключенный через веб чат
+    не должен возвращаться после перезапуска
+    """
+    if not os.path.exists(CHATS_FILE):
+        return
+    
+    with open(CHATS_FILE, "r", encoding="utf-8") as f:
+        lines = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    seeded = set(db.get_setting('chats_file_seeded') or [])
+    new = [line for line in lines if line not in seeded]
+    added = sum(db.add_chat_source(line) for line in new)
+    if new:
+        db.set_setting('chats_file_seeded', sorted(seeded.union(new)), 'json')
+    
+    log.info(f"💬 Чаты загружены из {CHATS_FILE} (новых: {added})")
+
+# Фразы живут в памяти и перечитываются из БД только после изменений
+# (в том числе сделанных через /api/keywords веб-сервера).
+# Исключающие фразы компилируются в тот же автомат и находятся тем же проходом.
+# С natasha фразы дополнительно ищутся по леммам с учетом словоизменения.
+KEYWORDS = live_keyword_matcher(db, CFG, LEMMATIZER)
+
+def get_keyword_matcher() -> KeywordIndex:
+    """Возвращает актуальный автомат по активным фразам"""
+    return KEYWORDS.get()
+
+def kw_find(text: str) -> list:
+    """
+    Все вхождения ключевых фраз из БД за один проход по тексту
+    """
+    matcher = get_keyword_matcher()
+    if not matcher:
+        log.warning("⚠️ Нет ключевых фраз - пропускаю все сообщения")
+        return []
+    return matcher.find_all(text)
+
+def kw_find_batch(texts) -> list:
+    """
+    Вхождения ключевых фраз для страницы сообщений: [[KeywordMatch, ...], ...]
+    """
+    matcher = get_keyword_matcher()
+    if not matcher:
+        log.warning("⚠️ Нет ключевых фраз - пропускаю все сообщения")
+        return [[] for _ in texts]
+    tokens_batch = normalize_tokens_batch(texts) if matcher.lemma is not None else None
+    return matcher.find_all_batch(texts, tokens_batch)
+
+def report_hits(matches) -> bool:
+    """
+    Учитывает и логирует найденные фразы. Возвращает True, если есть попадания
+    и нет ни одной исключающей фразы
+    """
+    if not matches:
+        return False
+
+    matches, excluded = KeywordIndex.split(matches)
+    if excluded:
+        negative = KeywordMatcher.matched_phrases(excluded)
+        KEYWORDS.record_hits(negative, negative=True)
+        if VERBOSE_LOGS:
+            log.info(f"🚫 Сообщение отброшено по исключающим фразам: {', '.join(repr(p) for p in negative)}")
+        return False
+    if not matches:
+        return False
+
+    phrases = KeywordMatcher.matched_phrases(matches)
+    KEYWORDS.record_hits(phrases)
+    fuzzy = [f"'{m.phrase}' (опечаток: {m.distance})" for m in matches if m.kind == 'fuzzy']
+    if fuzzy:
+        log.info(f"🎯 НАЙДЕНЫ ФРАЗЫ С ОПЕЧАТКАМИ: {', '.join(fuzzy)}")
+    else:
+        log.info(f"🎯 НАЙДЕНЫ ФРАЗЫ: {', '.join(repr(p) for p in phrases)}")
+    return True
 
 def kw_hit(text: str) -> bool:
     """
     СТРОГИЙ поиск только по полным фразам из БД
     """
-    keywords = db.get_keywords()
-    if not keywords:
-        log.warning("⚠️ Нет ключевых фраз - пропускаю все сообщения")
+    return report_hits(kw_find(text))
+
+# ---------- оценка качества ----------
+# Правила живут в таблице scoring_rules (редактируются через /api/scoring-rules)
+# и пересобираются в памяти только после изменений
+# Модель лидов подключается позже, в load_lead_model
+SCORING = live_lead_scorer(db, CFG)
+
+def load_lead_model() -> bool:
+    """Подключает обученный классификатор лидов, если файл модели есть"""
+    path = CFG.get("lead_model_file", "data/lead_model.npz")
+    if not path or not os.path.exists(path):
         return False
-    
-    text_lower = text.lower()
-    
-    # Ищем ТОЛЬКО полные фразы
-    for phrase in keywords:
-        if phrase in text_lower:
-            log.info(f"🎯 НАЙДЕНА ФРАЗА: '{phrase}'")
-            return True
-    
-    return False
+    try:
+        from lead_classifier import LeadClassifier
+        SCORING.classifier = LeadClassifier.load(path)
+    except Exception as e:
+        log.warning(f"⚠️ Не удалось загрузить модель лидов {path}: {e}")
+        return False
+    log.info(f"🤖 Модель лидов загружена: {path}")
+    return True
 
 def analyze_lead_quality(text: str, sender=None) -> dict:
     """
     Анализирует качество потенциального лида.
     """
-    score = 0
-    reasons = []
-    
-    text_lower = text.lower()
-    
-    # Положительные сигналы для оценки качества
-    positive_signals = [
-        ("бюджет", 3, "💰 Упоминает бюджет"),
-        ("готов платить", 3, "💰 Готов платить"),
-        ("плачу", 3, "💰 Готов платить"),
-        ("оплачу", 3, "💰 Готов платить"),
-        ("срочно", 2, "⚡ Срочная потребность"),
-        ("deadline", 2, "📅 Есть дедлайн"),
-        ("дедлайн", 2, "📅 Есть дедлайн"),
-        ("опытного", 2, "⭐ Ищет опытного специалиста"),
-        ("портфолио", 2, "📁 Интересует портфолио"),
-        ("примеры работ", 2, "📁 Хочет видеть примеры"),
-        ("техническое задание", 2, "📋 Есть ТЗ"),
-        ("тз", 1, "📋 Есть ТЗ"),
-        ("профессионал", 2, "⭐ Ищет профессионала"),
-        ("качественно", 1, "✨ Важно качество"),
-        ("быстро", 1, "⚡ Нужно быстро"),
-    ]
-    
-    for signal, points, reason in positive_signals:
-        if signal in text_lower:
-            score += points
-            reasons.append(reason)
-    
-    # Негативные сигналы (снижают качество)
-    negative_signals = [
-        ("бесплатно", -5, "🚫 Ищет бесплатно"),
-        ("даром", -5, "🚫 Ищет даром"),
-        ("без оплаты", -5, "🚫 Без оплаты"),
-        ("взаимозачет", -3, "🤝 Взаимозачет"),
-        ("процент", -2, "📈 Процент от прибыли"),
-        ("стажер", -2, "👶 Ищет стажера"),
-        ("новичок", -1, "👶 Ищет новичка"),
-        ("дешево", -2, "💸 Ищет дешево"),
-        ("недорого", -1, "💸 Ищет недорого"),
-    ]
-    
-    for signal, points, reason in negative_signals:
-        if signal in text_lower:
-            score += points
-            reasons.append(reason)
-    
-    # Определяем категорию качества
-    if score >= 5:
-        quality = "🔥 ГОРЯЧИЙ ЛИД"
-    elif score >= 2:
-        quality = "🟡 ХОРОШИЙ ЛИД"
-    elif score >= 0:
-        quality = "🟢 ОБЫЧНЫЙ ЛИД"
-    else:
-        quality = "🔴 НИЗКОЕ КАЧЕСТВО"
-    
-    return {
-        "score": score,
-        "quality": quality,
-        "reasons": reasons
-    }
+    return SCORING.score(text)
+
+def analyze_lead_quality_batch(texts) -> list:
+    """
+    Оценивает качество сразу для страницы сообщений.
+    Результат совпадает с analyze_lead_quality для каждого текста.
+    """
+    return SCORING.score_batch(list(texts))
+
+# ---------- дубликаты ----------
+# Один заказ часто публикуют в нескольких чатах: копии в пределах окна
+# сохраняются со ссылкой на первый лид и повторно не пересылаются.
+# Индекс создается при старте (near_duplicates тянет numpy)
+DUPLICATES = None
+
+def load_duplicate_index():
+    """Создает индекс дубликатов и заполняет его лидами за окно"""
+    global DUPLICATES
+    from near_duplicates import NearDuplicateIndex
+
+    index = NearDuplicateIndex(
+        window_seconds=float(CFG.get("duplicate_window_hours", 24)) * 3600,
+        threshold=float(CFG.get("duplicate_threshold", 0.5)),
+        min_words=int(CFG.get("duplicate_min_words", 5)),
+    )
+    for lead_id, text, added_at in db.get_lead_texts_since(index.window_seconds):
+        # timestamp лидов хранится в UTC (CURRENT_TIMESTAMP)
+        ts = datetime.strptime(added_at[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        index.add(text, lead_id, ts.timestamp())
+    DUPLICATES = index
+    log.info(f"♻️ Индекс дубликатов: {len(index)} лидов за последние {index.window_seconds / 3600:g} ч")
+
+# ---------- уже обработанные сообщения ----------
+# Пары (чат, id сообщения) сохраненных лидов: повторный скан истории
+# после перезапуска отбрасывает их до поиска фраз и оценки
+SEEN = SeenMessages()
+
+def load_seen_messages():
+    """Заполняет фильтр обработанных сообщений из БД"""
+    for chat_id, message_id in db.get_seen_messages():
+        SEEN.add(chat_id, message_id)
+    log.info(f"👁️ Уже обработано сообщений: {len(SEEN)} ({SEEN.memory_bytes() // 1024} КБ)")
+
+def already_seen(entity, message) -> bool:
+    return (getattr(entity, "id", None), message.id) in SEEN
 
 # Функция генерации ответа с Together.ai
 async def generate_together_response(lead_message, lead_quality, sender_name="Клиент"):
@@ -306,6 +510,8 @@ async def generate_together_response(lead_message, lead_quality, sender_name="К
 
 Ответ:"""
 
+    import requests
+
     try:
         # Пробуем модели по очереди с повторными попытками
         for model_index, model in enumerate(TOGETHER_MODELS, 1):
@@ -458,6 +664,26 @@ def generate_fallback_response(lead_message, lead_quality):
     return random.choice(options)
 
 # Функция отправки автоответа
+def send_destination_key(entity):
+    """Ключ получателя для лимитов отправки"""
+    return getattr(entity, 'id', entity)
+
+def account_of(message) -> Account:
+    """Аккаунт, которым получено сообщение (по умолчанию основной)"""
+    return POOL.by_client(getattr(message, "client", None)) or POOL.primary
+
+async def limited_send(entity, text, account: Account = None, **kwargs):
+    """send_message аккаунта через его ограничитель отправки"""
+    account = account or POOL.primary
+    return await account.limiter.call(send_destination_key(entity),
+                                      lambda: account.client.send_message(entity, text, **kwargs))
+
+async def limited_forward(entity, message, account: Account = None):
+    """forward_messages аккаунта через его ограничитель отправки"""
+    account = account or POOL.primary
+    return await account.limiter.call(send_destination_key(entity),
+                                      lambda: account.client.forward_messages(entity, message))
+
 async def send_auto_reply_together(src_entity, original_message, lead_analysis):
     """
     Отправляет автоматический ответ с Together.ai ИИ
@@ -487,9 +713,9 @@ async def send_auto_reply_together(src_entity, original_message, lead_analysis):
         return
     
     # Генерируем ответ
-    sender = await original_message.get_sender()
+    sender = await SENDERS.profile(original_message)
     sender_name = "Клиент"
-    if isinstance(sender, User) and sender.first_name:
+    if sender is not None and sender.is_user and sender.first_name:
         sender_name = sender.first_name
     
     ai_response = await generate_together_response(
@@ -524,7 +750,7 @@ async def send_auto_reply_together(src_entity, original_message, lead_analysis):
     
     try:
         # Отправляем ответ в тот же чат где найден лид
-        await client.send_message(src_entity, ai_response)
+        await limited_send(src_entity, ai_response, account=account_of(original_message))
         daily_replies_count += 1
         
         log.info(f"✅ Together.ai автоответ отправлен! ({daily_replies_count}/{MAX_REPLIES_PER_DAY} за день)")
@@ -533,17 +759,29 @@ async def send_auto_reply_together(src_entity, original_message, lead_analysis):
         if FORWARD_TARGET:
             notification = f"🤖 **TOGETHER.AI АВТООТВЕТ**\n\n📝 **Ответ:** {ai_response}\n\n📊 **Качество лида:** {lead_analysis['quality']}\n📈 **Счетчик:** {daily_replies_count}/{MAX_REPLIES_PER_DAY}"
             try:
-                await client.send_message(FORWARD_TARGET, notification, parse_mode='markdown')
+                await limited_send(FORWARD_TARGET, notification, parse_mode='markdown')
             except:
-                await client.send_message(FORWARD_TARGET, notification)
+                await limited_send(FORWARD_TARGET, notification)
                 
     except Exception as e:
         log.error(f"⚠ Ошибка отправки Together.ai автоответа: {e}")
 
+def chat_source_key(entity) -> str:
+    """Ключ чата в chat_sources и leads.chat_source: username без @ или chat_<id>"""
+    chat_source = getattr(entity, "username", None)
+    if not chat_source:
+        chat_source = f"chat_{entity.id}" if hasattr(entity, 'id') else "unknown_chat"
+    
+    # Убираем @ если есть
+    if chat_source.startswith('@'):
+        chat_source = chat_source[1:]
+    return chat_source
+
 # Функция проверки времени сообщения
-def is_message_in_timeframe(message_date) -> bool:
+def is_message_in_timeframe(message_date, date_from: datetime = None) -> bool:
     """
     Проверяет, попадает ли сообщение в нужный временной интервал
+    (от date_from, по умолчанию — от начала окна поиска на текущий момент)
     """
     # Убираем timezone для корректного сравнения
     msg_time = message_date.replace(tzinfo=None) if message_date.tzinfo else message_date
@@ -554,14 +792,20 @@ def is_message_in_timeframe(message_date) -> bool:
         return False
     
     # Проверяем, что сообщение в нужном диапазоне
-    return msg_time >= DATE_FROM
+    return msg_time >= (date_from or search_window_start())
 
 # ---------- хелперы ----------
-async def resolve_chat(raw: str):
+async def resolve_chat(raw: str, account: Account = None):
     """
     Возвращает entity группы/чата. Каналы (broadcast=True) пропускаем.
     Улучшенная обработка разных форматов ссылок.
+    Разрешенные чаты берутся из entity_cache, пока не истек TTL.
     """
+    account = account or POOL.primary
+    client = account.client
+    entity = account.entities.get(raw)
+    if entity is not None:
+        return accept_chat_entity(raw, entity)
     try:
         # Различные форматы ссылок
         if raw.startswith('https://t.me/'):
@@ -584,28 +828,54 @@ async def resolve_chat(raw: str):
         elif raw.lstrip("-").isdigit():
             # -1001234567890
             entity = await client.get_entity(int(raw))
+        elif raw.startswith("chat_") and raw[5:].isdigit():
+            # chat_1234567890 — ключ chat_sources для чата без username;
+            # access_hash берется из сессии Telethon
+            try:
+                try:
+                    entity = await client.get_entity(PeerChannel(int(raw[5:])))
+                except ValueError:
+                    entity = await client.get_entity(PeerChat(int(raw[5:])))
+            except ValueError:
+                # Чат не знаком сессии (другой аккаунт пула, новая сессия):
+                # разрешаем по ссылке, с которой источник был добавлен
+                source_ref = db.get_chat_source_ref(raw)
+                if not source_ref or source_ref == raw:
+                    raise
+                entity = await resolve_chat(source_ref, account)
+                if entity is not None:
+                    account.entities.put(raw, entity)
+                return entity
         else:
             # jetlagchat
             entity = await client.get_entity(raw)
         
-        # Проверяем тип entity
-        if isinstance(entity, Channel) and getattr(entity, "broadcast", False):
-            log.info(f"⚠️ Пропуск канала (broadcast): {raw}")
-            return None  # канал — не чат/группа
-        
-        if isinstance(entity, Chat):
-            return entity
-        
-        if isinstance(entity, Channel) and getattr(entity, "megagroup", False):
-            return entity
-            
-        log.info(f"⚠️ Неподдерживаемый тип entity: {type(entity)} для {raw}")
-        return None
+        account.entities.put(raw, entity)
+        return accept_chat_entity(raw, entity)
         
+    except (rpcerrorlist.FloodWaitError, *ACCOUNT_LOST_ERRORS):
+        # Длинное ожидание и потерю аккаунта решает вызывающий код
+        raise
     except Exception as e:
         log.error(f"Не удалось получить {raw}: {e}")
         return None
 
+def accept_chat_entity(raw: str, entity):
+    """entity, если это чат или супергруппа; каналы и прочее — None"""
+    # Проверяем тип entity
+    if isinstance(entity, Channel) and getattr(entity, "broadcast", False):
+        log.info(f"⚠️ Пропуск канала (broadcast): {raw}")
+        return None  # канал — не чат/группа
+    
+    if isinstance(entity, Chat):
+        return entity
+    
+    if isinstance(entity, Channel) and getattr(entity, "megagroup", False):
+        return entity
+        
+    log.info(f"⚠️ Неподдерживаемый тип entity: {type(entity)} для {raw}")
+    return None
+
 async def resolve_forward_target():
     """
     Цель пересылки: 'me' / @username / numeric id.
@@ -616,8 +886,18 @@ async def resolve_forward_target():
         target = FORWARD_TO_ENV or "me"
     if str(target).lower() == "me":
         return "me"
+    entity = ENTITIES.get(target)
+    if entity is not None:
+        return entity
     try:
-        return await client.get_entity(int(target)) if str(target).lstrip("-").isdigit() else await client.get_entity(str(target))
+        try:
+            entity = await client.get_entity(int(target)) if str(target).lstrip("-").isdigit() else await client.get_entity(str(target))
+        except rpcerrorlist.FloodWaitError as e:
+            log.warning(f"🚧 FloodWait {e.seconds} с при получении цели пересылки")
+            await asyncio.sleep(e.seconds + 1)
+            entity = await client.get_entity(int(target)) if str(target).lstrip("-").isdigit() else await client.get_entity(str(target))
+        ENTITIES.put(target, entity)
+        return entity
     except Exception as e:
         log.error(f"Не смог получить цель пересылки {target}: {e}")
         return "me"
@@ -650,9 +930,101 @@ def format_target_display(target):
 
 # НАЙДИТЕ ЭТУ ФУНКЦИЮ В app.py И ЗАМЕНИТЕ НА ИСПРАВЛЕННУЮ ВЕРСИЮ:
 
-async def forward_with_card(src_entity, message):
+# ---------- доставка ----------
+# Обнаружение лида только кладет карточку в очередь с приоритетом по очкам
+# (горячие первыми), а отдельный воркер отправляет их со своей паузой
+SEND_QUEUE = None
+_SEND_SEQ = itertools.count()
+_SENDER_TASK = None
+
+def start_sender():
+    """Создает очередь доставки и запускает воркер (в цикле клиента)"""
+    global SEND_QUEUE, _SENDER_TASK
+    if _SENDER_TASK is not None:
+        return
+    SEND_QUEUE = asyncio.PriorityQueue()
+    _SENDER_TASK = asyncio.create_task(sender_worker())
+    asyncio.create_task(publish_send_stats(SEND_STATS_INTERVAL))
+
+async def publish_send_stats(interval: float):
+    """
+    Периодически пишет состояние ограничителей отправки в system_settings
+    (send_stats), откуда его читает /api/status процесса API
+    """
+    while True:
+        try:
+            db.set_setting('send_stats', {
+                'updated_at': datetime.now().isoformat(timespec='seconds'),
+                'queue': SEND_QUEUE.qsize(),
+                'accounts': POOL.stats(),
+            }, 'json')
+        except Exception as e:
+            log.error(f"❌ Ошибка сохранения статистики отправки: {e}")
+        await asyncio.sleep(interval)
+
+def enqueue_delivery(src_entity, message, card_text, lead_analysis):
+    """Ставит лид в очередь доставки"""
+    SEND_QUEUE.put_nowait((-lead_analysis['score'], next(_SEND_SEQ), src_entity, message, card_text, lead_analysis))
+    log_verbose(f"📬 Лид в очереди доставки (очки {lead_analysis['score']}, в очереди {SEND_QUEUE.qsize()})")
+
+async def deliver_lead(src_entity, message, card_text, lead_analysis):
+    """Отправляет карточку, пересылает оригинал и запускает автоответ"""
+    # Отправляем карточку
+    try:
+        await limited_send(FORWARD_TARGET, card_text, parse_mode='markdown')
+    except Exception as e:
+        try:
+            card_text_plain = card_text.replace('[', '').replace('](tg://user?id=', ' (ID: ').replace(')', ')')
+            await limited_send(FORWARD_TARGET, card_text_plain)
+        except Exception as e2:
+            print(f"❌ Ошибка отправки карточки: {e2}")
+    
+    # Пересылаем оригинал. Сообщение из чата другого аккаунта основной
+    # аккаунт переслать не может — отправляем копию текста
+    try:
+        if account_of(message) is POOL.primary:
+            await limited_forward(FORWARD_TARGET, message)
+        else:
+            await limited_send(FORWARD_TARGET, f"💬 {message.text or ''}", link_preview=False)
+    except Exception as e:
+        log.error(f"Ошибка пересылки: {e}")
+    
+    # 🤖 ЗАПУСКАЕМ АВТООТВЕТ (в фоне)
+    if ENABLE_AUTO_REPLY and together_client:
+        log.info("🤖 Автоответы включены - отправляю ответ")
+        asyncio.create_task(send_auto_reply_together(src_entity, message, lead_analysis))
+    else:
+        log.info("💬 Автоответы отключены - только сохраняю лид")
+
+async def sender_worker():
+    """Разбирает очередь доставки: по одному лиду с паузой между ними"""
+    while True:
+        _, _, src_entity, message, card_text, lead_analysis = await SEND_QUEUE.get()
+        try:
+            await deliver_lead(src_entity, message, card_text, lead_analysis)
+        except Exception as e:
+            log.error(f"❌ Ошибка доставки лида: {e}")
+        finally:
+            SEND_QUEUE.task_done()
+        
+        # Пауза между лидами
+        delay = random.randint(SEND_DELAY_MIN, SEND_DELAY_MAX)
+        limits = SEND_LIMITER.stats()
+        log.info(f"⏳ Пауза {delay} сек до следующего лида (в очереди {SEND_QUEUE.qsize()}, "
+                 f"лимит {limits['rate']} сообщ/с, ждут отправки {limits['backlog']})")
+        await asyncio.sleep(delay)
+
+async def drain_send_queue():
+    """Ждет, пока воркер доставит все лиды из очереди"""
+    if SEND_QUEUE is not None and SEND_QUEUE.qsize():
+        log.info(f"📬 Дожидаюсь доставки {SEND_QUEUE.qsize()} лидов")
+    if SEND_QUEUE is not None:
+        await SEND_QUEUE.join()
+
+async def forward_with_card(src_entity, message, lead_analysis=None):
     """
-    ИСПРАВЛЕННАЯ версия с защитой от блокировки БД и правильным сохранением
+    ИСПРАВЛЕННАЯ версия с защитой от блокировки БД и правильным сохранением.
+    lead_analysis можно передать заранее (пакетная оценка при сканировании истории)
     """
     global FORWARD_TARGET
     if FORWARD_TARGET is None:
@@ -660,18 +1032,16 @@ async def forward_with_card(src_entity, message):
         log.info(f"➡️ Пересылаю в: {format_target_display(FORWARD_TARGET)}")
     
     try:
-        sender = await message.get_sender()
+        sender = await SENDERS.profile(message)
         display = "unknown"
         clickable_username = None
         
-        if isinstance(sender, User):
+        if sender is not None and sender.is_user:
             if sender.username:
                 display = f"@{sender.username}"
                 clickable_username = f"@{sender.username}"
             else:
-                first_name = sender.first_name or ""
-                last_name = sender.last_name or ""
-                full_name = " ".join([first_name, last_name]).strip()
+                full_name = sender.full_name
                 
                 if full_name:
                     display = f"{full_name}"
@@ -691,18 +1061,16 @@ async def forward_with_card(src_entity, message):
             pass
         
         # Анализ качества лида
-        lead_analysis = analyze_lead_quality(message.text or "", sender)
+        if lead_analysis is None:
+            lead_analysis = analyze_lead_quality(message.text or "", sender)
+        
+        # Почти такой же заказ уже был (кросспостинг по чатам)
+        msg_ts = message.date.timestamp()
+        duplicate_of = DUPLICATES.find(message.text or "", msg_ts) if DUPLICATES is not None else None
         
         # 💾 ИСПРАВЛЕННОЕ СОХРАНЕНИЕ В БД
         try:
-            # Получаем chat_source с fallback
-            chat_source = getattr(src_entity, "username", None)
-            if not chat_source:
-                chat_source = f"chat_{src_entity.id}" if hasattr(src_entity, 'id') else "unknown_chat"
-            
-            # Убираем @ если есть
-            if chat_source.startswith('@'):
-                chat_source = chat_source[1:]
+            chat_source = chat_source_key(src_entity)
             
             print(f"💾 Сохраняю лид: chat_source='{chat_source}', sender='{display}'")
             
@@ -714,8 +1082,15 @@ async def forward_with_card(src_entity, message):
                 quality_score=lead_analysis['score'],
                 quality_label=lead_analysis['quality'],
                 quality_reasons=lead_analysis['reasons'],
-                chat_name=chat_title
+                chat_name=chat_title,
+                duplicate_of=duplicate_of,
+                chat_id=getattr(src_entity, "id", None),
+                message_id=message.id
             )
+            SEEN.add(getattr(src_entity, "id", None), message.id)
+            if lead_id == 0:
+                # Сообщение уже было сохранено раньше (например, другим процессом)
+                return
             
             print(f"✅ Лид сохранен в БД с ID: {lead_id}")
             
@@ -725,6 +1100,12 @@ async def forward_with_card(src_entity, message):
             # Продолжаем выполнение даже если сохранение не удалось
             lead_id = 0
         
+        if duplicate_of is not None:
+            log.info(f"♻️ Дубликат лида {duplicate_of} из {chat_title} - не пересылаю")
+            return
+        if DUPLICATES is not None and lead_id:
+            DUPLICATES.add(message.text or "", lead_id, msg_ts)
+        
         # 📡 УВЕДОМЛЯЕМ ВЕБ-ИНТЕРФЕЙС О НОВОМ ЛИДЕ
         try:
             await notify_web_interface('new_lead', {
@@ -761,33 +1142,8 @@ async def forward_with_card(src_entity, message):
         
         card_text = "\n".join(card_lines)
         
-        # Отправляем карточку
-        try:
-            await client.send_message(FORWARD_TARGET, card_text, parse_mode='markdown')
-        except Exception as e:
-            try:
-                card_text_plain = card_text.replace('[', '').replace('](tg://user?id=', ' (ID: ').replace(')', ')')
-                await client.send_message(FORWARD_TARGET, card_text_plain)
-            except Exception as e2:
-                print(f"❌ Ошибка отправки карточки: {e2}")
-        
-        # Пересылаем оригинал
-        try:
-            await client.forward_messages(FORWARD_TARGET, message)
-        except Exception as e:
-            log.error(f"Ошибка пересылки: {e}")
-        
-        # 🤖 ЗАПУСКАЕМ АВТООТВЕТ (в фоне)
-        if ENABLE_AUTO_REPLY and together_client:
-            log.info("🤖 Автоответы включены - отправляю ответ")
-            asyncio.create_task(send_auto_reply_together(src_entity, message, lead_analysis))
-        else:
-            log.info("💬 Автоответы отключены - только сохраняю лид")
-        
-        # Пауза между лидами
-        delay = random.randint(3, 15)
-        log.info(f"⏳ Пауза {delay} сек до следующего лида")
-        await asyncio.sleep(delay)
+        # Доставка идет через очередь: обнаружение не ждет отправки и пауз
+        enqueue_delivery(src_entity, message, card_text, lead_analysis)
         
     except Exception as e:
         print(f"❌ Критическая ошибка в forward_with_card: {e}")
@@ -795,92 +1151,233 @@ async def forward_with_card(src_entity, message):
         traceback.print_exc()
 
 # API эндпоинты для веб-интерфейса
-@api_app.route('/api/status')
-def get_status():
-    """API: Получить статус бота"""
-    stats = db.get_leads_stats()
-    return jsonify({
-        'telegram_connected': client.is_connected() if client else False,
-        'ai_connected': bool(TOGETHER_API_KEY and ENABLE_TOGETHER_AI),
-        'monitoring_active': True,  # Пока всегда активен
-        **stats
-    })
-
-@api_app.route('/api/leads')
-def get_leads():
-    """API: Получить список лидов"""
-    limit = request.args.get('limit', 20, type=int)
-    leads = db.get_recent_leads(limit)
-    return jsonify(leads)
+def create_api_app():
+    """Создает Flask-приложение с API (Flask импортируется только здесь)"""
+    global api_app, socketio
+    if api_app is not None:
+        return api_app
+
+    from flask import Flask, jsonify, request
+    from flask_socketio import SocketIO
+
+    api_app = Flask(__name__)
+    api_app.config['SECRET_KEY'] = 'your-secret-key-here'
+    socketio = SocketIO(api_app, cors_allowed_origins="*")
+
+    @api_app.route('/api/status')
+    def get_status():
+        """API: Получить статус бота"""
+        stats = db.get_leads_stats()
+        return jsonify({
+            'telegram_connected': client.is_connected() if client else False,
+            'ai_connected': bool(TOGETHER_API_KEY and ENABLE_TOGETHER_AI),
+            'monitoring_active': True,  # Пока всегда активен
+            # Отправляет бот (другой процесс): читаем опубликованную им сводку
+            'send_stats': db.get_setting('send_stats'),
+            **stats
+        })
+
+    @api_app.route('/api/leads')
+    def get_leads():
+        """API: Получить список лидов"""
+        limit = request.args.get('limit', 20, type=int)
+        leads = db.get_recent_leads(limit)
+        return jsonify(leads)
+
+    return api_app
 
 # ---------- режимы ----------
-async def scan_history():
-    """Сканирует историю чатов и ищет лиды"""
-    load_keywords_from_file()  # Загружаем ключевые слова из файла
-    
-    all_msgs = []
-    with open(CHATS_FILE, "r", encoding="utf-8") as f:
-        raw_chats = [l.strip() for l in f if l.strip()]
+async def process_scan_page(entity, raw, title, page, all_msgs) -> int:
+    """
+    Проверяет страницу сообщений истории целиком: фильтр по длине,
+    поиск фраз и оценка качества выполняются над списком текстов,
+    а на пересылку уходят только совпадения
+    """
+    page = [m for m in page if not already_seen(entity, m)]
+    if not page:
+        return 0
 
-    now = datetime.now()
-    log.info(f"🕐 Поиск сообщений с {DATE_FROM.strftime('%Y-%m-%d %H:%M:%S')} по {now.strftime('%Y-%m-%d %H:%M:%S')}")
+    texts = [m.text or "" for m in page]
+    long_enough = [i for i, t in enumerate(texts) if len(t) >= MIN_LENGTH]
+    if not long_enough:
+        return 0
 
-    for raw in raw_chats:
-        entity = await resolve_chat(raw)
-        if not entity:
-            log.info(f"⭕ Пропуск (не чат/группа): {raw}")
-            continue
+    candidates = [texts[i] for i in long_enough]
+    matches = kw_find_batch(candidates)
+    hit_rows = [i for i, found in enumerate(matches) if report_hits(found)]
+    if not hit_rows:
+        return 0
+
+    analyses = analyze_lead_quality_batch([candidates[i] for i in hit_rows])
 
-        title = getattr(entity, "title", str(raw))
+    passed = 0
+    for i, lead_analysis in zip(hit_rows, analyses):
+        m = page[long_enough[i]]
+        txt = candidates[i]
+
+        all_msgs.append({
+            "chat": title,
+            "chat_ref": raw,
+            "id": m.id,
+            "date": m.date.strftime("%Y-%m-%d %H:%M:%S"),
+            "sender_id": m.sender_id,
+            "text": txt[:200]  # ограничиваем длину для CSV
+        })
+        passed += 1
+
+        # Сразу пересылаем
+        await forward_with_card(entity, m, lead_analysis)
+    return passed
+
+async def scan_chat(raw: str, all_msgs: list, account: Account = None, date_from: datetime = None) -> dict:
+    """
+    Сканирует один чат аккаунтом account с date_from (по умолчанию — с
+    начала окна поиска на момент вызова). Возвращает его статистику
+    """
+    account = account or POOL.primary
+    date_from = date_from or search_window_start()
+    started = time.perf_counter()
+    stats = {"chat": raw, "checked": 0, "in_timeframe": 0, "passed": 0, "seconds": 0.0, "ok": False}
+
+    entity = await resolve_chat(raw, account)
+    if not entity:
+        log.info(f"⭕ Пропуск (не чат/группа): {raw}")
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    title = getattr(entity, "title", str(raw))
+    stats["chat"] = title
+    chat_key = chat_source_key(entity)
+    checked = passed = in_timeframe = too_old_count = 0
+    page = []
+
+    # Сообщения идут от новых к старым: с курсором — только новее
+    # обработанного, и в любом случае не старше начала окна поиска.
+    # Так бюджет MAX_MESSAGES_PER_CHAT тратится на свежие сообщения,
+    # даже если курсор остался далеко за окном после долгого простоя
+    last_id = db.get_scan_cursor(chat_key)
+    if last_id:
+        log.info(f"🔎 Парсим: {title} (новее сообщения {last_id})")
+    else:
         log.info(f"🔎 Парсим: {title}")
-        checked = passed = in_timeframe = too_old_count = 0
+    messages = account.client.iter_messages(entity, min_id=last_id, limit=MAX_MESSAGES_PER_CHAT)
+    newest_id, newest_date = last_id, None
 
-        try:
-            async for m in client.iter_messages(entity, limit=MAX_MESSAGES_PER_CHAT):
-                checked += 1
-                
-                # Проверяем время сообщения
-                if not is_message_in_timeframe(m.date):
-                    too_old_count += 1
-                    # Если подряд 10 сообщений слишком старые - останавливаемся
-                    if too_old_count >= 10:
-                        log.info(f"ℹ️ Достигнута граница времени в {title}")
-                        break
-                    continue
-                else:
-                    too_old_count = 0  # сбрасываем счетчик
-                    in_timeframe += 1
-                
-                txt = m.text or ""
-                if len(txt) < MIN_LENGTH:
-                    continue
-                if not kw_hit(txt):
-                    continue
+    try:
+        async for m in messages:
+            checked += 1
+            if m.id > newest_id:
+                newest_id, newest_date = m.id, m.date
+            
+            # Проверяем время сообщения
+            if not is_message_in_timeframe(m.date, date_from):
+                too_old_count += 1
+                # Если подряд 10 сообщений слишком старые - останавливаемся
+                if too_old_count >= 10:
+                    log.info(f"ℹ️ Достигнута граница времени в {title}")
+                    break
+                continue
+            else:
+                too_old_count = 0  # сбрасываем счетчик
+                in_timeframe += 1
+            
+            # Копим страницу и обрабатываем её целиком
+            page.append(m)
+            if len(page) >= SCAN_PAGE_SIZE:
+                passed += await process_scan_page(entity, raw, title, page, all_msgs)
+                page = []
 
-                all_msgs.append({
-                    "chat": title,
-                    "chat_ref": raw,
-                    "id": m.id,
-                    "date": m.date.strftime("%Y-%m-%d %H:%M:%S"),
-                    "sender_id": m.sender_id,
-                    "text": txt[:200]  # ограничиваем длину для CSV
-                })
-                passed += 1
-
-                # Сразу пересылаем
-                await forward_with_card(entity, m)
-                
-        except Exception as e:
-            log.error(f"Ошибка при парсинге {title}: {e}")
-            continue
+        if page:
+            passed += await process_scan_page(entity, raw, title, page, all_msgs)
+        # Курсор — самое новое увиденное сообщение, только после полного прохода
+        if newest_id:
+            db.advance_scan_cursor(chat_key, title, newest_id, newest_date)
+        stats["ok"] = True
+    except (rpcerrorlist.FloodWaitError, *ACCOUNT_LOST_ERRORS):
+        raise
+    except Exception as e:
+        log.error(f"Ошибка при парсинге {title}: {e}")
+        # Сохраненный access_hash мог устареть: в следующий раз разрешаем заново
+        account.entities.forget(raw)
+    finally:
+        stats.update(checked=checked, in_timeframe=in_timeframe, passed=passed,
+                     seconds=time.perf_counter() - started)
 
+    if stats["ok"]:
         log.info(f"✅ {title}: проверено {checked}, в периоде {in_timeframe}, найдено {passed}")
+    return stats
+
+async def scan_chat_limited(raw: str, all_msgs: list, semaphores: dict, date_from: datetime = None) -> dict:
+    """
+    scan_chat аккаунтом-владельцем чата под семафором этого аккаунта.
+    При FloodWait или потере аккаунта чат переходит следующему аккаунту;
+    если другого нет — ждет, сколько просит Telegram, и повторяет
+    """
+    attempts = 0
+    while True:
+        account = POOL.owner(raw)
+        if account is None:
+            log.error(f"⛔ Нет доступных аккаунтов для {raw}")
+            return {"chat": raw, "checked": 0, "in_timeframe": 0, "passed": 0, "seconds": 0.0, "ok": False}
+        wait = account.available_at - time.monotonic()
+        if wait <= 0:
+            async with semaphores[account.name]:
+                try:
+                    return await scan_chat(raw, all_msgs, account, date_from)
+                except rpcerrorlist.FloodWaitError as e:
+                    attempts += 1
+                    wait = e.seconds + 1
+                    POOL.mark_flooded(account, wait)
+                except ACCOUNT_LOST_ERRORS as e:
+                    POOL.mark_lost(account, e)
+                    continue
+            if POOL.owner(raw) is not account:
+                continue
+        # Ждем вне семафора, чтобы не занимать слот; курсор и фильтр
+        # обработанных сообщений не дадут переслать уже отправленное
+        if attempts > SCAN_FLOOD_RETRIES:
+            log.error(f"🚧 FloodWait в {raw}: попытки исчерпаны")
+            return {"chat": raw, "checked": 0, "in_timeframe": 0, "passed": 0, "seconds": 0.0, "ok": False}
+        log.warning(f"🚧 FloodWait в {raw}: жду {wait} с (попытка {attempts})")
+        await asyncio.sleep(wait)
+
+async def scan_history():
+    """Сканирует историю чатов и ищет лиды"""
+    load_keywords_from_file()  # Загружаем ключевые слова из файла
+    
+    load_chats_from_file()
+    
+    all_msgs = []
+    raw_chats = await unique_chat_refs(db.get_active_chat_refs())
+
+    now = datetime.now()
+    date_from = now - SEARCH_WINDOW
+    log.info(f"🕐 Поиск сообщений с {date_from.strftime('%Y-%m-%d %H:%M:%S')} по {now.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # Чаты сканируются параллельно, но не больше SCAN_CONCURRENCY одновременно на аккаунт
+    started = time.perf_counter()
+    semaphores = {account.name: asyncio.Semaphore(SCAN_CONCURRENCY) for account in POOL.accounts}
+    if len(POOL) > 1:
+        shards = POOL.shard(raw_chats)
+        log.info("🧩 Чаты по аккаунтам: " + ", ".join(f"{name}: {len(chats)}" for name, chats in shards.items()))
+    results = await asyncio.gather(*(scan_chat_limited(raw, all_msgs, semaphores, date_from) for raw in raw_chats))
+    wall = time.perf_counter() - started
+    sequential = sum(r["seconds"] for r in results)
+    log.info(
+        f"📈 Чатов: {len(results)} (успешно {sum(r['ok'] for r in results)}), "
+        f"проверено {sum(r['checked'] for r in results)}, в периоде {sum(r['in_timeframe'] for r in results)}, "
+        f"найдено {sum(r['passed'] for r in results)}; "
+        f"время {wall:.1f} с против {sequential:.1f} с последовательно (параллельность {SCAN_CONCURRENCY})"
+    )
+    log.info(f"📇 Чаты из кэша: {sum(a.entities.hits for a in POOL.accounts)}, "
+             f"разрешено через сеть: {sum(a.entities.misses for a in POOL.accounts)}")
 
     if not all_msgs:
         log.warning("⚠️ Ничего не найдено по заданным условиям")
         return
 
     # Сохраняем результаты
+    import pandas as pd
     df = pd.DataFrame(all_msgs).drop_duplicates(subset=["text"])
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     
@@ -896,27 +1393,246 @@ async def scan_history():
     
     log.info(f"📊 Итого найдено {len(df)} уникальных лидов за {time_desc}")
 
-async def watch():
-    """Мониторинг новых сообщений в реальном времени"""
-    load_keywords_from_file()  # Загружаем ключевые слова из файла
-    
-    with open(CHATS_FILE, "r", encoding="utf-8") as f:
-        raw_chats = [l.strip() for l in f if l.strip()]
+# Наблюдаемые чаты: peer id чата -> состояние (ссылка, entity, аккаунт, название, счетчики).
+# Один обработчик NewMessage на все чаты: чужие сообщения отсекаются поиском в словаре
+WATCHED = {}
+_WATCH_HANDLER_ADDED = False
 
-    for raw in raw_chats:
-        entity = await resolve_chat(raw)
-        if not entity:
+def watch_chat(raw: str, entity, account: Account = None) -> int:
+    """Добавляет чат в наблюдение (повторное добавление обновляет ссылку, entity и аккаунт)"""
+    chat_id = utils.get_peer_id(entity)
+    state = WATCHED.get(chat_id)
+    if state is None:
+        state = WATCHED[chat_id] = {"received": 0, "matched": 0}
+    state.update(raw=raw, entity=entity, account=account or POOL.primary,
+                 title=getattr(entity, "title", str(raw)))
+    return chat_id
+
+def unwatch_chat(chat_id: int) -> bool:
+    """Убирает чат из наблюдения"""
+    return WATCHED.pop(chat_id, None) is not None
+
+async def on_new_message(event):
+    """Общий обработчик новых сообщений всех наблюдаемых чатов всех аккаунтов"""
+    state = WATCHED.get(event.chat_id)
+    # Чат может быть у нескольких аккаунтов — обрабатывает только владелец
+    if state is None or state["account"].client is not event.client:
+        return
+    state["received"] += 1
+    entity = state["entity"]
+    txt = event.message.message or ""
+    if already_seen(entity, event.message):
+        return
+    if len(txt) < MIN_LENGTH or not kw_hit(txt):
+        return
+    state["matched"] += 1
+    log.info(f"📡 {state['title']}: {txt[:140].replace(chr(10), ' ')}")
+    await forward_with_card(entity, event.message)
+
+def start_watch_handler():
+    """Регистрирует общий обработчик на клиентах всех аккаунтов один раз"""
+    global _WATCH_HANDLER_ADDED
+    if not _WATCH_HANDLER_ADDED:
+        for account in POOL.accounts:
+            account.client.add_event_handler(on_new_message, events.NewMessage())
+        _WATCH_HANDLER_ADDED = True
+
+async def resolve_owned_chat(raw: str):
+    """
+    Разрешает чат аккаунтом-владельцем. Аккаунт, который не может открыть
+    чат или не состоит в нем (обновления из чата ему не придут), для этого
+    чата пропускается, как и аккаунт на FloodWait или потерянный, — чат
+    достается следующему на кольце. Возвращает (аккаунт, entity); если в
+    чате не состоит ни один аккаунт — аккаунт, который хотя бы видит его;
+    аккаунт None, если доступных аккаунтов сейчас нет
+    """
+    tried = set()
+    fallback = None
+    while True:
+        account = POOL.owner(raw)
+        if account is None or not account.available():
+            return fallback or (None, None)
+        if account.name in tried:
+            if fallback:
+                log.warning(f"⚠️ Ни один аккаунт не состоит в {raw}: новые сообщения из него не придут")
+            return fallback or (account, None)
+        tried.add(account.name)
+        try:
+            entity = await resolve_chat(raw, account)
+        except rpcerrorlist.FloodWaitError as e:
+            POOL.mark_flooded(account, e.seconds + 1)
+            tried.discard(account.name)
             continue
-        title = getattr(entity, "title", str(raw))
+        except ACCOUNT_LOST_ERRORS as e:
+            POOL.mark_lost(account, e)
+            continue
+        if entity is not None and not getattr(entity, "left", False):
+            return account, entity
+        POOL.exclude(raw, account)
+        if entity is not None and fallback is None:
+            fallback = (account, entity)
 
-        # фикс late-binding: прокидываем значения в дефолты
-        @client.on(events.NewMessage(chats=entity))
-        async def _handler(event, _entity=entity, _title=title):
-            txt = event.message.message or ""
-            if len(txt) < MIN_LENGTH or not kw_hit(txt):
-                return
-            log.info(f"📡 {_title}: {txt[:140].replace(chr(10), ' ')}")
-            await forward_with_card(_entity, event.message)
+async def rebalance_watched(interval: float):
+    """
+    Периодически переносит чаты к текущим владельцам: от аккаунтов на
+    FloodWait, отключенных или потерянных — к другим, и обратно
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for account in POOL.accounts:
+                if account.lost is None and not account.client.is_connected():
+                    POOL.mark_flooded(account, interval)
+            for state in list(WATCHED.values()):
+                raw = state["raw"]
+                if POOL.owner(raw) is state["account"]:
+                    continue
+                account, entity = await resolve_owned_chat(raw)
+                if entity and account is not state["account"]:
+                    watch_chat(raw, entity, account)
+                    log.info(f"🔀 {raw}: теперь наблюдает аккаунт {account.name}")
+        except Exception as e:
+            log.error(f"❌ Ошибка перераспределения чатов: {e}")
+
+# Источники из chat_sources: ссылка -> peer id чата
+SOURCES = {}
+# Неразрешенные ссылки (не чат, ошибка сети, нет доступа): ссылка -> когда пробовать снова (monotonic)
+UNRESOLVED = {}
+
+def chat_type_of(entity) -> str:
+    return "supergroup" if isinstance(entity, Channel) else "group"
+
+async def resolve_chat_source(ref: str):
+    """
+    resolve_owned_chat для строки chat_sources. Статистика и курсор чата
+    пишутся под chat_source_key, поэтому источник переводится на этот ключ.
+    Если чат под этим ключом выключен, entity — None
+    """
+    account, entity = await resolve_owned_chat(ref)
+    if entity:
+        key = chat_source_key(entity)
+        if key != ref:
+            account.entities.put(key, entity)
+            if not db.canonicalize_chat_source(ref, key, getattr(entity, "title", None), chat_type_of(entity)):
+                log.info(f"⏸️ {ref}: чат {key} выключен")
+                return account, None
+    return account, entity
+
+async def unique_chat_refs(refs: list) -> list:
+    """
+    Оставляет по одной ссылке на чат. Один чат может быть в chat_sources
+    несколько раз (@username из chats.txt и строка под chat_source_key),
+    и без этого он сканировался бы параллельно. Неразрешенные ссылки
+    остаются как есть (их обработает scan_chat_limited), кроме влитых
+    в выключенную строку чата
+    """
+    limit = asyncio.Semaphore(SCAN_CONCURRENCY)
+
+    async def resolve(ref):
+        async with limit:
+            return await resolve_chat_source(ref)
+
+    resolved = await asyncio.gather(*(resolve(ref) for ref in refs))
+    active = set(db.get_active_chat_refs())
+    unique, seen = [], set()
+    for ref, (account, entity) in zip(refs, resolved):
+        if entity:
+            chat_id = utils.get_peer_id(entity)
+            if chat_id in seen:
+                continue
+            seen.add(chat_id)
+        elif ref not in active:
+            continue
+        unique.append(ref)
+    if len(unique) < len(refs):
+        log.info(f"🧹 Повторных и выключенных ссылок на чаты: {len(refs) - len(unique)}")
+    return unique
+
+async def sync_chat_sources() -> tuple:
+    """
+    Приводит наблюдение к активным строкам chat_sources. Возвращает
+    (новые чаты, снятые с наблюдения, отложенные). Отложенные — ссылки,
+    которые сейчас некому разрешить (все аккаунты на FloodWait), и
+    неразрешенные ссылки: их снова пробуем через CHAT_SOURCES_RETRY_INTERVAL
+    """
+    refs = db.get_active_chat_refs()
+    active = set(refs)
+    added, removed, pending = [], [], 0
+    now = time.monotonic()
+
+    for ref in refs:
+        if ref in SOURCES:
+            continue
+        if UNRESOLVED.get(ref, 0) > now:
+            pending += 1
+            continue
+        try:
+            account, entity = await resolve_chat_source(ref)
+            if account is None:
+                pending += 1
+                continue
+            if not entity:
+                UNRESOLVED[ref] = now + CHAT_SOURCES_RETRY_INTERVAL
+                pending += 1
+                continue
+            chat_id = utils.get_peer_id(entity)
+            state = WATCHED.get(chat_id)
+            if state is None or state["raw"] not in active:
+                watch_chat(ref, entity, account)
+            SOURCES[ref] = chat_id
+            UNRESOLVED.pop(ref, None)
+            if state is None:
+                added.append(ref)
+        except Exception as e:
+            log.error(f"❌ Не удалось поставить на наблюдение {ref}: {e}")
+            UNRESOLVED[ref] = now + CHAT_SOURCES_RETRY_INTERVAL
+            pending += 1
+
+    for ref in [ref for ref in UNRESOLVED if ref not in active]:
+        del UNRESOLVED[ref]
+    for ref in [ref for ref in SOURCES if ref not in active]:
+        chat_id = SOURCES.pop(ref)
+        if chat_id not in SOURCES.values() and unwatch_chat(chat_id):
+            removed.append(ref)
+    return added, removed, pending
+
+async def watch_chat_sources(interval: float, version: int, pending: int = 0):
+    """
+    Следит за версией chat_sources: новые чаты разрешаются, досканируются
+    и ставятся на наблюдение, удаленные и выключенные — снимаются
+    """
+    semaphores = {account.name: asyncio.Semaphore(SCAN_CONCURRENCY) for account in POOL.accounts}
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = db.get_table_version('chat_sources')
+            if current == version and not pending:
+                continue
+            added, removed, pending = await sync_chat_sources()
+            # Версию запоминаем только после удачной синхронизации:
+            # иначе изменения, на которых она упала, больше не проверятся
+            version = current
+            for ref in added:
+                log.info(f"➕ Новый чат: {WATCHED[SOURCES[ref]]['title']} ({ref}), досканирую историю")
+                # Окно считается от момента добавления чата, а не от старта бота
+                asyncio.create_task(scan_chat_limited(ref, [], semaphores, search_window_start()))
+            for ref in removed:
+                log.info(f"➖ Чат снят с наблюдения: {ref}")
+        except Exception as e:
+            log.error(f"❌ Ошибка обновления списка чатов: {e}")
+
+async def watch():
+    """Мониторинг новых сообщений в реальном времени (список чатов — chat_sources)"""
+    load_keywords_from_file()  # Загружаем ключевые слова из файла
+    load_chats_from_file()
+
+    version = db.get_table_version('chat_sources')
+    _, _, pending = await sync_chat_sources()
+    start_watch_handler()
+    log.info(f"👁️ Наблюдаю за {len(WATCHED)} чатами")
+    asyncio.create_task(watch_chat_sources(CHAT_SOURCES_CHECK_INTERVAL, version, pending))
+    if len(POOL) > 1:
+        asyncio.create_task(rebalance_watched(ACCOUNT_REBALANCE_INTERVAL))
             
 async def ensure_client_connected():
     """Убеждаемся что клиент подключен"""
@@ -936,6 +1652,28 @@ async def ensure_client_connected():
         log.error(f"❌ Ошибка подключения к Telegram: {e}")
         return False
 
+
+async def connect_accounts():
+    """
+    Подключает дополнительные аккаунты. Используются только уже
+    авторизованные сессии: вход по коду здесь не запрашивается
+    """
+    for account in POOL.accounts[1:]:
+        try:
+            await account.client.connect()
+            if not await account.client.is_user_authorized():
+                POOL.mark_lost(account, "сессия не авторизована")
+                continue
+            me = await account.client.get_me()
+            log.info(f"✅ Аккаунт {account.name}: {me.first_name} (@{me.username})")
+        except Exception as e:
+            POOL.mark_lost(account, e)
+
+async def disconnect_accounts():
+    """Отключает дополнительные аккаунты"""
+    for account in POOL.accounts[1:]:
+        if account.client.is_connected():
+            await account.client.disconnect()
         
 async def main(mode: str):
     log.info("🚀 Запуск Telegram Scout")
@@ -951,34 +1689,68 @@ async def main(mode: str):
         log.info("🔌 Подключение к Telegram...")
         await client.start()
         log.info("✅ Подключен к Telegram")
+    if len(POOL) > 1:
+        await connect_accounts()
+        log.info(f"👥 Аккаунтов: {sum(a.lost is None for a in POOL.accounts)} из {len(POOL)}")
+    STARTUP.mark("подключение к Telegram")
+    
+    # Модели natasha грузим только после подключения
+    if load_nlp():
+        STARTUP.mark("загрузка natasha")
+    
+    load_keywords_from_file()
+    KEYWORDS.refresh()
+    KEYWORDS.start_hit_flusher(float(CFG.get("keyword_hits_flush_interval", 5)))
+    SCORING.refresh()
+    STARTUP.mark("ключевые фразы")
+    if load_lead_model():
+        STARTUP.mark("модель лидов")
+    load_duplicate_index()
+    load_seen_messages()
+    STARTUP.mark("индексы дубликатов")
+    STARTUP.report()
+    start_sender()
     
     if mode in ("scan", "both"):
         log.info("🔍 Начинаю поиск лидов...")
         await scan_history()
+        save_lemma_cache()
         if mode == "scan":
+            await drain_send_queue()
             log.info("✅ Сканирование завершено")
             return
     
     if mode in ("watch", "both"):
         log.info("👁️ Запускаю мониторинг новых сообщений...")
         await watch()
+        if USE_NATASHA:
+            asyncio.create_task(lemma_cache_autosave(int(CFG.get("lemma_cache_save_interval", 600))))
         log.info("🚀 Мониторинг активен (Ctrl+C для остановки)")
         await client.run_until_disconnected()
 
-def run_telegram_bot():
+def run_telegram_bot(mode: str = "both"):
     """Запуск Telegram бота в отдельном потоке"""
     try:
         with client:
-            client.loop.run_until_complete(main("both"))
+            try:
+                client.loop.run_until_complete(main(mode))
+            finally:
+                client.loop.run_until_complete(disconnect_accounts())
     except KeyboardInterrupt:
         log.info("👋 Остановка по команде пользователя")
     except Exception as e:
         log.error(f"⚠ Критическая ошибка: {e}")
+    finally:
+        KEYWORDS.stop_hit_flusher()
+        save_lemma_cache()
 
 def run_api_server():
     """Запуск API сервера"""
+    create_api_app()
     socketio.run(api_app, host='0.0.0.0', port=8080, debug=False)
 
+STARTUP.mark("импорт модулей и конфигурация")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Telegram scout via personal account")
     parser.add_argument("--mode",
@@ -992,4 +1764,4 @@ if __name__ == "__main__":
         run_api_server()
     else:
         # Только Telegram бот
-        run_telegram_bot()
+        run_telegram_bot(args.mode)
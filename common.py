@@ -0,0 +1,79 @@
+"""
+Общие части модулей бота и веб-сервера.
+
+WORD_RE — символы слова: один набор для поиска фраз, лемматизации,
+классификатора лидов и поиска дубликатов.
+
+LiveTables — объект, собранный из таблиц БД и пересобираемый только
+после изменения их версии (см. SharedDatabase.get_table_version).
+На нем построены ключевые фразы (keyword_matcher.py) и правила оценки
+лидов (lead_scoring.py), поэтому проверка версий у них одинаковая.
+"""
+
+import logging
+import re
+import threading
+import time
+from typing import Tuple
+
+log = logging.getLogger("tg-scout")
+
+WORD_RE = re.compile(r"[a-zA-Zа-яА-ЯёЁ0-9#@_]+")
+
+
+class LiveTables:
+    """
+    Объект, скомпилированный из таблиц TABLES, в памяти процесса.
+
+    Таблицы перечитываются только когда меняется их версия, а сами
+    версии проверяются не чаще одного раза в check_interval секунд.
+    Новый объект подменяет старый одним присваиванием, поэтому поток,
+    который им пользуется, всегда видит целый набор.
+    Наследник задает TABLES, WHAT, _compile() и _describe()
+    """
+
+    TABLES: Tuple[str, ...] = ()
+    # Что собирается (в родительном падеже) — для сообщений об ошибках
+    WHAT = "таблиц"
+
+    def __init__(self, db, check_interval: float, initial):
+        self.db = db
+        self.check_interval = check_interval
+        self.version = None
+        self._compiled = initial
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Возвращает актуальный объект"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning(f"⚠️ Не удалось проверить версию {self.WHAT}: {e}")
+        return self._compiled
+
+    def refresh(self, force: bool = False) -> bool:
+        """Пересобирает объект, если таблицы изменились. Возвращает True при пересборке"""
+        with self._lock:
+            # Версии читаем до данных: изменение между запросами
+            # просто приведет к повторной пересборке на следующей проверке
+            version = tuple(self.db.get_table_version(table) for table in self.TABLES)
+            if not force and version == self.version:
+                return False
+
+            compiled = self._compile()
+            self._compiled = compiled
+            self.version = version
+
+        log.info(self._describe(compiled, version))
+        return True
+
+    def _compile(self):
+        raise NotImplementedError
+
+    def _describe(self, compiled, version: Tuple[int, ...]) -> str:
+        """Строка лога о пересборке"""
+        return f"Собрано из {', '.join(self.TABLES)} (версия {'/'.join(map(str, version))})"
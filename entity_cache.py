@@ -0,0 +1,88 @@
+"""
+Кэш разрешенных сущностей Telegram (чаты, каналы, пользователи).
+
+client.get_entity для каждой строки chats.txt — это сетевой запрос
+(для @username — ResolveUsernameRequest с жесткими лимитами). Для
+обращения к чату достаточно id, access_hash и типа, поэтому результат
+разрешения сохраняется в таблицу entity_cache и в пределах TTL
+восстанавливается в объект Telethon без сети. access_hash действителен
+только для аккаунта, который его получил, поэтому ключ включает имя сессии.
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from telethon.tl.types import Channel, Chat, ChatPhotoEmpty, User
+
+log = logging.getLogger("tg-scout")
+
+
+def entity_fields(entity) -> Optional[Dict[str, Any]]:
+    """Поля сущности для кэша; None для неподдерживаемых типов"""
+    if isinstance(entity, Channel):
+        kind = 'channel'
+        title = entity.title
+    elif isinstance(entity, Chat):
+        kind = 'chat'
+        title = entity.title
+    elif isinstance(entity, User):
+        kind = 'user'
+        title = " ".join(p for p in (entity.first_name, entity.last_name) if p)
+    else:
+        return None
+    return {
+        'kind': kind,
+        'entity_id': entity.id,
+        'access_hash': getattr(entity, 'access_hash', None),
+        'title': title,
+        'username': getattr(entity, 'username', None),
+        'megagroup': bool(getattr(entity, 'megagroup', False)),
+        'broadcast': bool(getattr(entity, 'broadcast', False)),
+        'left': bool(getattr(entity, 'left', False)),
+    }
+
+
+def restore_entity(fields: Dict[str, Any]):
+    """Объект Telethon из сохраненных полей (без обращения к сети)"""
+    kind = fields['kind']
+    if kind == 'channel':
+        return Channel(id=fields['entity_id'], title=fields['title'], photo=ChatPhotoEmpty(), date=None,
+                       access_hash=fields['access_hash'], username=fields['username'],
+                       megagroup=fields['megagroup'], broadcast=fields['broadcast'],
+                       left=fields['left'])
+    if kind == 'chat':
+        return Chat(id=fields['entity_id'], title=fields['title'], photo=ChatPhotoEmpty(),
+                    participants_count=0, date=None, version=0, left=fields['left'])
+    if kind == 'user':
+        return User(id=fields['entity_id'], access_hash=fields['access_hash'],
+                    first_name=fields['title'], username=fields['username'])
+    return None
+
+
+class EntityCache:
+    """Сущности аккаунта по исходной ссылке (строка chats.txt, @username, id)"""
+
+    def __init__(self, db, account: str, ttl_seconds: float = 72 * 3600):
+        self.db = db
+        self.account = account
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ref) -> Optional[Any]:
+        """Сущность из кэша, если запись моложе TTL"""
+        fields = self.db.get_cached_entity(self.account, str(ref), self.ttl_seconds)
+        entity = restore_entity(fields) if fields else None
+        if entity is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entity
+
+    def put(self, ref, entity):
+        fields = entity_fields(entity)
+        if fields:
+            self.db.save_cached_entity(self.account, str(ref), fields)
+
+    def forget(self, ref):
+        self.db.delete_cached_entity(self.account, str(ref))
@@ -0,0 +1,539 @@
+"""
+Компилируемый поиск ключевых фраз (алгоритм Aho-Corasick).
+
+Автомат строится один раз из списка активных фраз и затем находит
+все вхождения всех фраз за один проход по тексту сообщения.
+Второй автомат работает по последовательностям лемм и находит
+фразы с учетом словоизменения.
+"""
+
+import logging
+import threading
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from common import WORD_RE, LiveTables
+
+log = logging.getLogger("tg-scout")
+
+# Разделители при пакетном поиске: не встречаются ни во фразах, ни в леммах
+_TEXT_SEP = "\x00"
+_LEMMA_SEP = object()
+
+
+class KeywordMatch(NamedTuple):
+    """
+    Найденное вхождение фразы: [start, end) в тексте в нижнем регистре.
+    kind — каким способом найдено: 'exact' (подстрока), 'lemma' (по леммам)
+    или 'fuzzy' (с опечатками, distance — расстояние Левенштейна).
+    negative — фраза исключающая: сообщение с ней нужно отбросить
+    """
+    phrase: str
+    start: int
+    end: int
+    kind: str = 'exact'
+    distance: int = 0
+    negative: bool = False
+
+
+class _Automaton:
+    """Автомат Aho-Corasick над последовательностями любых хешируемых символов"""
+
+    def __init__(self):
+        # Состояние 0 — корень бора
+        self.goto: List[Dict[Hashable, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]
+
+    def add(self, index: int, symbols: Sequence[Hashable]):
+        """Добавляет последовательность в бор"""
+        state = 0
+        for sym in symbols:
+            nxt = self.goto[state].get(sym)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][sym] = nxt
+            state = nxt
+        self.out[state].append(index)
+
+    def build(self):
+        """Строит суффиксные ссылки обходом в ширину"""
+        goto, fail, out = self.goto, self.fail, self.out
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for sym, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and sym not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(sym, 0)
+                # Наследуем выходы суффиксного состояния
+                if out[fail[nxt]]:
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+
+    def iter_hits(self, symbols: Iterable[Hashable]) -> Iterator[Tuple[int, int]]:
+        """Один проход по символам: пары (позиция последнего символа, индекс шаблона)"""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for pos, sym in enumerate(symbols):
+            while state and sym not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(sym, 0)
+            if out[state]:
+                for index in out[state]:
+                    yield pos, index
+
+
+def _unique_phrases(phrases: Iterable[str]) -> List[str]:
+    """Фразы в нижнем регистре без повторов, в исходном порядке"""
+    return list(dict.fromkeys(p for p in ((p or "").strip().lower() for p in phrases) if p))
+
+
+class KeywordMatcher:
+    """Автомат Aho-Corasick по символам ключевых фраз"""
+
+    def __init__(self, phrases: Iterable[str], negative: Iterable[str] = ()):
+        self.phrases: List[str] = _unique_phrases(phrases)
+        # Исключающие фразы компилируются в тот же автомат, а их
+        # вхождения помечаются флагом negative
+        self.negative = frozenset(_unique_phrases(negative))
+        self._automaton = _Automaton()
+        for index, phrase in enumerate(self.phrases):
+            self._automaton.add(index, phrase)
+        self._automaton.build()
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def __bool__(self) -> bool:
+        return bool(self.phrases)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Возвращает все вхождения всех фраз за один проход по тексту"""
+        phrases, negative = self.phrases, self.negative
+        matches = []
+        for pos, index in self._automaton.iter_hits(text.lower()):
+            phrase = phrases[index]
+            matches.append(KeywordMatch(phrase, pos + 1 - len(phrase), pos + 1,
+                                        'exact', 0, phrase in negative))
+        return matches
+
+    def find_all_batch(self, texts: Sequence[str]) -> List[List[KeywordMatch]]:
+        """
+        Вхождения для пачки текстов за один проход автомата: тексты
+        склеиваются через символ, которого нет ни в одной фразе,
+        а позиции попаданий раскладываются обратно по текстам.
+        """
+        result: List[List[KeywordMatch]] = [[] for _ in texts]
+        if not texts:
+            return result
+        lowered = [t.lower() for t in texts]
+        starts = []
+        offset = 0
+        for t in lowered:
+            starts.append(offset)
+            offset += len(t) + len(_TEXT_SEP)
+
+        phrases, negative = self.phrases, self.negative
+        for pos, index in self._automaton.iter_hits(_TEXT_SEP.join(lowered)):
+            phrase = phrases[index]
+            start = pos + 1 - len(phrase)
+            i = bisect_right(starts, start) - 1
+            result[i].append(KeywordMatch(phrase, start - starts[i], pos + 1 - starts[i],
+                                          'exact', 0, phrase in negative))
+        return result
+
+    def search(self, text: str) -> Optional[KeywordMatch]:
+        """Возвращает первое вхождение (по позиции конца) или None"""
+        for pos, index in self._automaton.iter_hits(text.lower()):
+            phrase = self.phrases[index]
+            return KeywordMatch(phrase, pos + 1 - len(phrase), pos + 1,
+                                'exact', 0, phrase in self.negative)
+        return None
+
+    @staticmethod
+    def matched_phrases(matches: Iterable[KeywordMatch]) -> List[str]:
+        """Уникальные фразы из списка вхождений в порядке появления"""
+        return list(dict.fromkeys(m.phrase for m in matches))
+
+
+# Токенизатор с лемматизацией: текст -> [(лемма, start, stop), ...]
+Tokenizer = Callable[[str], List[Tuple[str, int, int]]]
+
+
+class LemmaPhraseMatcher:
+    """
+    Бор по последовательностям лемм ключевых фраз.
+
+    Каждая фраза лемматизируется один раз при сборке, сообщение — один раз
+    при поиске, после чего последовательность лемм проходит через автомат.
+    Так "ищем видеографов" находится по фразе "ищу видеографа".
+    """
+
+    def __init__(self, phrases: Iterable[str], tokenizer: Tokenizer, negative: Iterable[str] = ()):
+        self.tokenizer = tokenizer
+        self.negative = frozenset(_unique_phrases(negative))
+        self.phrases: List[str] = []
+        self._lengths: List[int] = []
+        self._automaton = _Automaton()
+        for phrase in _unique_phrases(phrases):
+            lemmas = [lemma for lemma, _, _ in tokenizer(phrase)]
+            if not lemmas:
+                continue
+            self._automaton.add(len(self.phrases), lemmas)
+            self.phrases.append(phrase)
+            self._lengths.append(len(lemmas))
+        self._automaton.build()
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def __bool__(self) -> bool:
+        return bool(self.phrases)
+
+    def find_all(self, text: str, tokens: List[Tuple[str, int, int]] = None) -> List[KeywordMatch]:
+        """Все вхождения по леммам; tokens можно передать, если текст уже разобран"""
+        if tokens is None:
+            tokens = self.tokenizer(text)
+        matches = []
+        for pos, index in self._automaton.iter_hits(lemma for lemma, _, _ in tokens):
+            first = tokens[pos + 1 - self._lengths[index]]
+            phrase = self.phrases[index]
+            matches.append(KeywordMatch(phrase, first[1], tokens[pos][2],
+                                        'lemma', 0, phrase in self.negative))
+        return matches
+
+    def find_all_batch(self, tokens_batch: Sequence[List[Tuple[str, int, int]]]) -> List[List[KeywordMatch]]:
+        """Вхождения по леммам для пачки уже разобранных текстов за один проход"""
+        result: List[List[KeywordMatch]] = [[] for _ in tokens_batch]
+        starts = []
+        symbols = []
+        for tokens in tokens_batch:
+            starts.append(len(symbols))
+            symbols.extend(lemma for lemma, _, _ in tokens)
+            symbols.append(_LEMMA_SEP)
+
+        for pos, index in self._automaton.iter_hits(symbols):
+            first_pos = pos + 1 - self._lengths[index]
+            i = bisect_right(starts, first_pos) - 1
+            tokens = tokens_batch[i]
+            first = tokens[first_pos - starts[i]]
+            last = tokens[pos - starts[i]]
+            phrase = self.phrases[index]
+            result[i].append(KeywordMatch(phrase, first[1], last[2],
+                                          'lemma', 0, phrase in self.negative))
+        return result
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> Optional[int]:
+    """Расстояние Левенштейна, если оно не больше max_distance, иначе None"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for i, cb in enumerate(b, 1):
+        current = [i]
+        for j, ca in enumerate(a, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        # Минимум строки не убывает — дальше расстояние только растет
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class FuzzyPhraseMatcher:
+    """
+    Поиск фраз с опечатками через индекс символьных n-грамм.
+
+    Фраза из k слов сравнивается с окнами из k подряд идущих слов
+    сообщения. Кандидаты отсекаются q-граммным фильтром: при расстоянии d
+    у строк остается не меньше |G(фраза)| - q·d общих n-грамм. Окна —
+    подстроки сообщения, поэтому фильтр сначала применяется ко всему
+    сообщению через инвертированный индекс n-грамм: у обычного сообщения
+    кандидатов нет, и окна не строятся вовсе. Для оставшихся фраз окна
+    сверяются по длине и n-граммам, и точное расстояние считается только
+    для прошедших фильтр.
+    """
+
+    def __init__(self, phrases: Iterable[str], max_distance: int = 1,
+                 min_length: int = 8, q: int = 3):
+        self.max_distance = max_distance
+        self.q = q
+        # Исходные фразы и их нормализованный вид (слова через один пробел)
+        self.phrases: List[str] = []
+        self._normalized: List[str] = []
+        self._grams: List[frozenset] = []
+        # Минимум общих n-грамм с окном на расстоянии не больше max_distance
+        self._min_shared: List[int] = []
+        # Длины окон в словах: опечатка может убрать или добавить пробел,
+        # поэтому фраза сверяется с окнами всех длин
+        self._word_counts = set()
+        self._index: Dict[str, List[int]] = {}
+
+        for phrase in _unique_phrases(phrases):
+            words = WORD_RE.findall(phrase)
+            normalized = " ".join(words)
+            if len(normalized) < min_length:
+                continue
+            index = len(self.phrases)
+            grams = self._ngrams(normalized)
+            self.phrases.append(phrase)
+            self._normalized.append(normalized)
+            self._grams.append(grams)
+            self._min_shared.append(len(grams) - q * max_distance)
+            self._word_counts.add(len(words))
+            for gram in grams:
+                self._index.setdefault(gram, []).append(index)
+
+    def _ngrams(self, s: str) -> frozenset:
+        q = self.q
+        return frozenset(s[i:i + q] for i in range(max(len(s) - q + 1, 1)))
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def __bool__(self) -> bool:
+        return bool(self.phrases)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Лучшее нечеткое вхождение каждой фразы (с минимальным расстоянием)"""
+        if not self.phrases:
+            return []
+        words = [(m.group(), m.start(), m.end()) for m in WORD_RE.finditer(text.lower())]
+        if not words:
+            return []
+
+        # Общие n-граммы фраз со всем сообщением — верхняя граница для любого окна
+        shared: Dict[int, int] = {}
+        for gram in self._ngrams(" ".join(w for w, _, _ in words)):
+            for index in self._index.get(gram, ()):
+                shared[index] = shared.get(index, 0) + 1
+        candidates = [index for index, count in shared.items() if count >= self._min_shared[index]]
+        if not candidates:
+            return []
+
+        best: Dict[int, KeywordMatch] = {}
+        max_distance = self.max_distance
+        for k in self._word_counts:
+            for i in range(len(words) - k + 1):
+                window = " ".join(w for w, _, _ in words[i:i + k])
+                grams = None
+                for index in candidates:
+                    if abs(len(self._normalized[index]) - len(window)) > max_distance:
+                        continue
+                    if grams is None:
+                        grams = self._ngrams(window)
+                    if len(grams & self._grams[index]) < self._min_shared[index]:
+                        continue
+                    distance = bounded_levenshtein(self._normalized[index], window, max_distance)
+                    if distance is None:
+                        continue
+                    current = best.get(index)
+                    if current is None or distance < current.distance:
+                        best[index] = KeywordMatch(self.phrases[index], words[i][1],
+                                                   words[i + k - 1][2], 'fuzzy', distance)
+        return sorted(best.values(), key=lambda m: (m.start, m.end, m.phrase))
+
+
+class KeywordIndex:
+    """
+    Все уровни поиска по одному набору фраз: точные подстроки,
+    (если задан токенизатор) совпадения по леммам и (если задано
+    fuzzy_max_distance) совпадения с опечатками.
+
+    Нечеткий уровень самый дорогой, поэтому он запускается только
+    для сообщений, в которых точные уровни ничего не нашли.
+
+    Исключающие фразы (exclusions) компилируются в те же автоматы
+    точного и лемматического поиска и находятся тем же проходом;
+    их вхождения помечены negative=True.
+    """
+
+    def __init__(self, phrases: Iterable[str], tokenizer: Tokenizer = None,
+                 fuzzy_max_distance: int = 0, fuzzy_min_length: int = 8,
+                 exclusions: Iterable[str] = ()):
+        self._positive = _unique_phrases(phrases)
+        known = set(self._positive)
+        self.exclusions = [p for p in _unique_phrases(exclusions) if p not in known]
+
+        self.exact = KeywordMatcher(self._positive + self.exclusions, self.exclusions)
+        self.lemma = (LemmaPhraseMatcher(self.exact.phrases, tokenizer, self.exclusions)
+                      if tokenizer else None)
+        self.fuzzy = (FuzzyPhraseMatcher(self._positive, fuzzy_max_distance, fuzzy_min_length)
+                      if fuzzy_max_distance > 0 else None)
+
+    @property
+    def phrases(self) -> List[str]:
+        return self._positive
+
+    def __len__(self) -> int:
+        return len(self._positive)
+
+    def __bool__(self) -> bool:
+        return bool(self._positive)
+
+    @staticmethod
+    def split(matches: Iterable[KeywordMatch]) -> Tuple[List[KeywordMatch], List[KeywordMatch]]:
+        """Разделяет вхождения на обычные и исключающие"""
+        positive, negative = [], []
+        for m in matches:
+            (negative if m.negative else positive).append(m)
+        return positive, negative
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Точные вхождения плюс найденные только по леммам фразы"""
+        matches = self.exact.find_all(text)
+        if self.lemma:
+            found = {m.phrase for m in matches}
+            matches.extend(m for m in self.lemma.find_all(text) if m.phrase not in found)
+        if self.fuzzy and not matches:
+            matches = self.fuzzy.find_all(text)
+        return matches
+
+    def find_all_batch(self, texts: Sequence[str],
+                       tokens_batch: Sequence[List[Tuple[str, int, int]]] = None) -> List[List[KeywordMatch]]:
+        """
+        То же, что find_all, для страницы сообщений: каждый уровень
+        проходит всю пачку одним запуском автомата
+        """
+        batch = self.exact.find_all_batch(texts)
+        if self.lemma:
+            if tokens_batch is None:
+                tokens_batch = [self.lemma.tokenizer(t) for t in texts]
+            for matches, lemma_matches in zip(batch, self.lemma.find_all_batch(tokens_batch)):
+                if lemma_matches:
+                    found = {m.phrase for m in matches}
+                    matches.extend(m for m in lemma_matches if m.phrase not in found)
+        if self.fuzzy:
+            for text, matches in zip(texts, batch):
+                if not matches:
+                    matches.extend(self.fuzzy.find_all(text))
+        return batch
+
+
+class LiveKeywordMatcher(LiveTables):
+    """
+    Скомпилированный набор фраз в памяти процесса.
+
+    Таблицы keywords и negative_keywords перечитываются только когда
+    меняется их версия (см. common.LiveTables).
+    """
+
+    TABLE = 'keywords'
+    NEGATIVE_TABLE = 'negative_keywords'
+    TABLES = (TABLE, NEGATIVE_TABLE)
+    WHAT = "ключевых фраз"
+
+    def __init__(self, db, check_interval: float = 0.5, tokenizer: Tokenizer = None,
+                 fuzzy_max_distance: int = 0, fuzzy_min_length: int = 8):
+        super().__init__(db, check_interval, KeywordIndex([]))
+        self.tokenizer = tokenizer
+        self.fuzzy_max_distance = fuzzy_max_distance
+        self.fuzzy_min_length = fuzzy_min_length
+
+        # Счетчики попаданий копятся в памяти (отдельно по таблицам)
+        # и сбрасываются в БД пачкой
+        self._hits: Dict[str, Dict[str, list]] = {self.TABLE: {}, self.NEGATIVE_TABLE: {}}
+        self._hits_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self) -> KeywordIndex:
+        """Возвращает актуальный автомат"""
+        return super().get()
+
+    def _describe(self, matcher: KeywordIndex, version) -> str:
+        lemma_info = f", по леммам {len(matcher.lemma)}" if matcher.lemma is not None else ""
+        fuzzy_info = f", с опечатками {len(matcher.fuzzy)}" if matcher.fuzzy is not None else ""
+        negative_info = f", исключений {len(matcher.exclusions)}" if matcher.exclusions else ""
+        return (f"🧩 Автомат ключевых фраз собран: {len(matcher)} фраз{lemma_info}{fuzzy_info}"
+                f"{negative_info} (версия {version[0]}/{version[1]})")
+
+    def _compile(self) -> KeywordIndex:
+        return KeywordIndex(self.db.get_keywords(), self.tokenizer,
+                            self.fuzzy_max_distance, self.fuzzy_min_length,
+                            exclusions=self.db.get_negative_keywords())
+
+    # ---------- статистика попаданий ----------
+    def record_hits(self, phrases: Iterable[str], negative: bool = False):
+        """Учитывает попадания фраз (без обращения к БД)"""
+        now = datetime.now()
+        with self._hits_lock:
+            counters = self._hits[self.NEGATIVE_TABLE if negative else self.TABLE]
+            for phrase in phrases:
+                entry = counters.get(phrase)
+                if entry is None:
+                    counters[phrase] = [1, now]
+                else:
+                    entry[0] += 1
+                    entry[1] = now
+
+    def flush_hits(self) -> int:
+        """Записывает накопленные счетчики в БД (транзакция на таблицу). Возвращает число фраз"""
+        with self._hits_lock:
+            pending, self._hits = self._hits, {self.TABLE: {}, self.NEGATIVE_TABLE: {}}
+
+        flushed = 0
+        for table, hits in pending.items():
+            if not hits:
+                continue
+            try:
+                self.db.add_keyword_hits({phrase: (count, last) for phrase, (count, last) in hits.items()},
+                                         table=table)
+            except Exception as e:
+                # Возвращаем счетчики обратно, чтобы не потерять их
+                with self._hits_lock:
+                    counters = self._hits[table]
+                    for phrase, (count, last) in hits.items():
+                        entry = counters.setdefault(phrase, [0, last])
+                        entry[0] += count
+                        entry[1] = max(entry[1], last)
+                log.warning(f"⚠️ Не удалось сохранить статистику фраз ({table}): {e}")
+                continue
+            flushed += len(hits)
+        return flushed
+
+    def start_hit_flusher(self, interval: float = 5.0):
+        """Запускает фоновый поток, сбрасывающий счетчики каждые interval секунд"""
+        if self._flusher is not None:
+            return
+        self._stop.clear()
+
+        def _run():
+            while not self._stop.wait(interval):
+                self.flush_hits()
+
+        self._flusher = threading.Thread(target=_run, name="keyword-hits-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop_hit_flusher(self):
+        """Останавливает фоновый поток и сбрасывает остаток счетчиков"""
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush_hits()
+
+
+def live_keyword_matcher(db, cfg: dict, lemmatizer=None) -> LiveKeywordMatcher:
+    """
+    LiveKeywordMatcher с настройками из config.json. Бот и веб-сервер
+    собирают автомат этой функцией, поэтому находят одни и те же вхождения.
+    lemmatizer — Lemmatizer (см. lemmatizer.py), если natasha включена
+    """
+    return LiveKeywordMatcher(
+        db,
+        check_interval=float(cfg.get("keywords_check_interval", 0.5)),
+        tokenizer=lemmatizer.tokens if lemmatizer is not None else None,
+        # Нечеткий поиск с опечатками (0 — выключен)
+        fuzzy_max_distance=int(cfg.get("fuzzy_max_distance", 0)),
+        fuzzy_min_length=int(cfg.get("fuzzy_min_length", 8)),
+    )
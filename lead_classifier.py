@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Локальный классификатор лидов (наивный Байес на хешированных n-граммах).
+
+Обучается офлайн по таблице leads: положительные примеры — лиды, на
+которые ответили (leads.responded или одобренный/отправленный
+pending_responses), отрицательные — отклоненные ответы и лиды, оставшиеся
+без ответа дольше min_age_days. Слова и пары соседних слов хешируются
+(crc32) в вектор фиксированной длины, поэтому модель — это один массив
+весов float32 и смещение в файле .npz. Оценка сообщения — сумма весов
+его признаков, без внешних сервисов и GPU.
+
+Обучение:  python lead_classifier.py [--out data/lead_model.npz]
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common import WORD_RE
+
+log = logging.getLogger("tg-scout")
+
+DEFAULT_MODEL_FILE = "data/lead_model.npz"
+
+
+def hashed_features(text: str, bits: int = 18) -> List[int]:
+    """Индексы признаков текста: слова и пары соседних слов (без повторов)"""
+    mask = (1 << bits) - 1
+    words = WORD_RE.findall((text or "").lower().replace("ё", "е"))
+    grams = set(words)
+    grams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return [zlib.crc32(g.encode("utf-8")) & mask for g in grams]
+
+
+def _pack(texts: Sequence[str], bits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Признаки пачки текстов: общий массив индексов и начало каждого текста"""
+    indices, starts, pos = [], [], 0
+    for text in texts:
+        features = hashed_features(text, bits)
+        starts.append(pos)
+        indices.extend(features)
+        pos += len(features)
+    return np.asarray(indices, dtype=np.int64), np.asarray(starts, dtype=np.int64)
+
+
+class LeadClassifier:
+    """Линейная модель: log-отношение правдоподобий признаков и априорное смещение"""
+
+    def __init__(self, weights: np.ndarray, bias: float, bits: int):
+        self.weights = weights.astype(np.float32)
+        self.bias = float(bias)
+        self.bits = bits
+
+    @classmethod
+    def train(cls, texts: Sequence[str], labels: Sequence[int], bits: int = 18,
+              alpha: float = 1.0) -> "LeadClassifier":
+        """Обучает наивный Байес с бинарными признаками за один проход по данным"""
+        labels = np.asarray(labels, dtype=bool)
+        indices, starts = _pack(texts, bits)
+        lengths = np.diff(np.append(starts, len(indices)))
+        row_labels = np.repeat(labels, lengths)
+
+        size = 1 << bits
+        pos_counts = np.bincount(indices[row_labels], minlength=size).astype(np.float64)
+        neg_counts = np.bincount(indices[~row_labels], minlength=size).astype(np.float64)
+        pos_total = pos_counts.sum() + alpha * size
+        neg_total = neg_counts.sum() + alpha * size
+        weights = np.log((pos_counts + alpha) / pos_total) - np.log((neg_counts + alpha) / neg_total)
+
+        n_pos = int(labels.sum())
+        n_neg = len(labels) - n_pos
+        bias = np.log((n_pos + 1) / (n_neg + 1))
+        return cls(weights, bias, bits)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LeadClassifier"]:
+        """Загружает модель из файла; None, если файла нет"""
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]), int(data["bits"]))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, weights=self.weights, bias=self.bias, bits=self.bits)
+        os.replace(tmp_path, path)
+
+    def decision(self, texts: Sequence[str]) -> np.ndarray:
+        """Линейные оценки пачки текстов одной векторной операцией"""
+        if not len(texts):
+            return np.zeros(0, dtype=np.float64)
+        indices, starts = _pack(texts, self.bits)
+        sums = np.zeros(len(texts), dtype=np.float64)
+        nonempty = np.diff(np.append(starts, len(indices))) > 0
+        if len(indices):
+            sums[nonempty] = np.add.reduceat(self.weights[indices].astype(np.float64), starts[nonempty])
+        return sums + self.bias
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        """Вероятность того, что на лид стоит ответить"""
+        return 1.0 / (1.0 + np.exp(-np.clip(self.decision(texts), -30, 30)))
+
+
+def load_training_data(db_path: str, min_age_days: int = 3) -> Tuple[List[str], List[int]]:
+    """Размеченные примеры из таблицы leads (без почти-дубликатов)"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT l.message_text,
+               CASE
+                   WHEN l.responded = 1 THEN 1
+                   WHEN EXISTS (SELECT 1 FROM pending_responses pr
+                                WHERE pr.lead_id = l.id AND pr.status IN ('approved', 'sent')) THEN 1
+                   WHEN EXISTS (SELECT 1 FROM pending_responses pr
+                                WHERE pr.lead_id = l.id AND pr.status = 'rejected') THEN 0
+                   WHEN l.timestamp < DATETIME('now', ?) THEN 0
+               END AS label
+        FROM leads l
+        -- Почти-дубликаты не доставляются и не получают ответа: их метка противоречила бы оригиналу
+        WHERE l.duplicate_of IS NULL
+    ''', (f"-{int(min_age_days)} days",))
+    texts, labels = [], []
+    for text, label in cursor.fetchall():
+        if label is not None and text:
+            texts.append(text)
+            labels.append(label)
+    conn.close()
+    return texts, labels
+
+
+def _auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """ROC AUC через ранги (без внешних библиотек)"""
+    n_pos = int(labels.sum())
+    n_neg = len(labels) - n_pos
+    if not n_pos or not n_neg:
+        return float("nan")
+    ranks = np.empty(len(scores), dtype=np.float64)
+    ranks[np.argsort(scores, kind="mergesort")] = np.arange(1, len(scores) + 1)
+    return float((ranks[labels].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение локального классификатора лидов")
+    parser.add_argument("--db", default="data/shared_bot.sqlite", help="Путь к базе")
+    parser.add_argument("--out", default=DEFAULT_MODEL_FILE, help="Файл модели")
+    parser.add_argument("--bits", type=int, default=18, help="Размер хеш-пространства, 2^bits")
+    parser.add_argument("--min-age-days", type=int, default=3,
+                        help="Лиды без ответа старше стольких дней считаются отрицательными")
+    args = parser.parse_args()
+
+    texts, labels = load_training_data(args.db, args.min_age_days)
+    y = np.asarray(labels, dtype=bool)
+    print(f"📚 Примеров: {len(texts)} (положительных {int(y.sum())}, отрицательных {int((~y).sum())})")
+    if not y.any() or y.all():
+        print("❌ Нужны и положительные, и отрицательные примеры")
+        return
+
+    # Отложенная выборка для оценки качества, затем обучение на всех данных
+    order = np.random.default_rng(0).permutation(len(texts))
+    split = int(len(order) * 0.8)
+    train_idx, test_idx = order[:split], order[split:]
+    if len(test_idx):
+        model = LeadClassifier.train([texts[i] for i in train_idx], y[train_idx], args.bits)
+        scores = model.decision([texts[i] for i in test_idx])
+        accuracy = float(((scores > 0) == y[test_idx]).mean())
+        print(f"📊 Отложенная выборка: точность {accuracy:.3f}, AUC {_auc(y[test_idx], scores):.3f}")
+
+    started = time.perf_counter()
+    model = LeadClassifier.train(texts, y, args.bits)
+    model.save(args.out)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    model.decision(texts)
+    per_message = (time.perf_counter() - started) / len(texts) * 1e6
+    print(f"✅ Модель сохранена в {args.out}: обучение {elapsed:.2f} с, оценка {per_message:.1f} мкс/сообщение")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Оценка качества лидов.
+
+Правила (сигнал, очки, причина) компилируются один раз в одно
+регулярное выражение, поэтому оценка сообщения — это один проход
+движка re по тексту, независимо от числа правил. Модуль используют
+и бот (app.py), и веб-сервер (web_server.py), так что оценки у них
+совпадают.
+
+Сами правила хранятся в таблице scoring_rules; LiveLeadScorer держит
+их скомпилированными в памяти и пересобирает только после изменений.
+"""
+
+import logging
+import re
+from typing import Iterable, List, Sequence, Tuple
+
+from common import LiveTables
+
+log = logging.getLogger("tg-scout")
+
+Signal = Tuple[str, int, str]
+
+# Правила по умолчанию: ими заполняется таблица scoring_rules при создании
+
+# Положительные сигналы для оценки качества
+POSITIVE_SIGNALS: List[Signal] = [
+    ("бюджет", 3, "💰 Упоминает бюджет"),
+    ("готов платить", 3, "💰 Готов платить"),
+    ("плачу", 3, "💰 Готов платить"),
+    ("оплачу", 3, "💰 Готов платить"),
+    ("срочно", 2, "⚡ Срочная потребность"),
+    ("deadline", 2, "📅 Есть дедлайн"),
+    ("дедлайн", 2, "📅 Есть дедлайн"),
+    ("опытного", 2, "⭐ Ищет опытного специалиста"),
+    ("портфолио", 2, "📁 Интересует портфолио"),
+    ("примеры работ", 2, "📁 Хочет видеть примеры"),
+    ("техническое задание", 2, "📋 Есть ТЗ"),
+    ("тз", 1, "📋 Есть ТЗ"),
+    ("профессионал", 2, "⭐ Ищет профессионала"),
+    ("качественно", 1, "✨ Важно качество"),
+    ("быстро", 1, "⚡ Нужно быстро"),
+]
+
+# Негативные сигналы (снижают качество)
+NEGATIVE_SIGNALS: List[Signal] = [
+    ("бесплатно", -5, "🚫 Ищет бесплатно"),
+    ("даром", -5, "🚫 Ищет даром"),
+    ("без оплаты", -5, "🚫 Без оплаты"),
+    ("взаимозачет", -3, "🤝 Взаимозачет"),
+    ("процент", -2, "📈 Процент от прибыли"),
+    ("стажер", -2, "👶 Ищет стажера"),
+    ("новичок", -1, "👶 Ищет новичка"),
+    ("дешево", -2, "💸 Ищет дешево"),
+    ("недорого", -1, "💸 Ищет недорого"),
+]
+
+
+def quality_label(score: int) -> str:
+    """Определяет категорию качества по очкам"""
+    if score >= 5:
+        return "🔥 ГОРЯЧИЙ ЛИД"
+    elif score >= 2:
+        return "🟡 ХОРОШИЙ ЛИД"
+    elif score >= 0:
+        return "🟢 ОБЫЧНЫЙ ЛИД"
+    else:
+        return "🔴 НИЗКОЕ КАЧЕСТВО"
+
+
+class LeadScorer:
+    """
+    Скомпилированный набор правил оценки.
+
+    Каждый сигнал учитывается не более одного раза на сообщение,
+    причины перечисляются в порядке правил.
+    """
+
+    def __init__(self, signals: Iterable[Signal]):
+        self.signals: List[Signal] = []
+        order = {}
+        for signal, points, reason in signals:
+            signal = signal.lower().strip()
+            if signal and signal not in order:
+                order[signal] = len(self.signals)
+                self.signals.append((signal, int(points), reason))
+        # Просмотр вперед находит сигнал в каждой позиции текста, включая
+        # перекрывающиеся; из альтернатив выбирается самая длинная, а более
+        # короткие сигналы, начинающиеся там же, добавляются через _covers
+        by_length = sorted(order, key=len, reverse=True)
+        self._pattern = re.compile(f"(?=({'|'.join(map(re.escape, by_length))}))") if order else None
+        self._covers = {
+            signal: [i for other, i in order.items() if signal.startswith(other)]
+            for signal in order
+        }
+        # Различных сочетаний сигналов немного, поэтому итог по сочетанию кэшируется
+        self._results = {}
+
+    def __len__(self) -> int:
+        return len(self.signals)
+
+    def _result(self, found_signals: frozenset) -> dict:
+        cached = self._results.get(found_signals)
+        if cached is None:
+            found = sorted({i for signal in found_signals for i in self._covers[signal]})
+            score = sum(self.signals[i][1] for i in found)
+            cached = (score, quality_label(score), [self.signals[i][2] for i in found])
+            if len(self._results) >= 4096:
+                self._results.clear()
+            self._results[found_signals] = cached
+        score, quality, reasons = cached
+        return {
+            "score": score,
+            "quality": quality,
+            "reasons": list(reasons)
+        }
+
+    def score(self, text: str) -> dict:
+        """Оценивает одно сообщение за один проход по тексту"""
+        if self._pattern is None:
+            return self._result(frozenset())
+        return self._result(frozenset(self._pattern.findall((text or "").lower())))
+
+    def score_batch(self, texts: Sequence[str]) -> List[dict]:
+        """Оценивает страницу сообщений"""
+        return [self.score(text) for text in texts]
+
+
+DEFAULT_SCORER = LeadScorer(POSITIVE_SIGNALS + NEGATIVE_SIGNALS)
+
+
+class LiveLeadScorer(LiveTables):
+    """
+    Правила оценки из БД, скомпилированные в памяти процесса.
+
+    Таблица scoring_rules перечитывается только когда меняется её версия
+    (см. common.LiveTables), поэтому оценка, идущая в другом потоке,
+    всегда видит целый набор правил.
+    """
+
+    TABLE = 'scoring_rules'
+    TABLES = (TABLE,)
+    WHAT = "правил оценки"
+
+    def __init__(self, db, check_interval: float = 0.5, classifier=None,
+                 classifier_points: int = 2, classifier_threshold: float = 0.8):
+        super().__init__(db, check_interval, DEFAULT_SCORER)
+        # Необязательный LeadClassifier (см. lead_classifier.py): уверенный
+        # прогноз модели добавляет или снимает classifier_points очков
+        self.classifier = classifier
+        self.classifier_points = classifier_points
+        self.classifier_threshold = classifier_threshold
+
+    def get(self) -> LeadScorer:
+        """Возвращает актуальный набор правил"""
+        return super().get()
+
+    def _compile(self) -> LeadScorer:
+        rules = self.db.get_scoring_rules()
+        return LeadScorer((r['signal'], r['points'], r['reason']) for r in rules)
+
+    def _describe(self, scorer: LeadScorer, version) -> str:
+        return f"📐 Правила оценки лидов собраны: {len(scorer)} сигналов (версия {version[0]})"
+
+    def _apply_classifier(self, texts: Sequence[str], results: List[dict]) -> List[dict]:
+        if self.classifier is None or not results:
+            return results
+        for result, p in zip(results, self.classifier.predict_proba(texts)):
+            if p >= self.classifier_threshold:
+                result["score"] += self.classifier_points
+                result["reasons"].append(f"🤖 Похоже на лиды с ответом ({p:.0%})")
+            elif p <= 1 - self.classifier_threshold:
+                result["score"] -= self.classifier_points
+                result["reasons"].append(f"🤖 Похоже на лиды без ответа ({p:.0%})")
+            else:
+                continue
+            result["quality"] = quality_label(result["score"])
+        return results
+
+    def score(self, text: str) -> dict:
+        return self._apply_classifier([text or ""], [self.get().score(text)])[0]
+
+    def score_batch(self, texts: Sequence[str]) -> List[dict]:
+        texts = [t or "" for t in texts]
+        return self._apply_classifier(texts, self.get().score_batch(texts))
+
+
+def live_lead_scorer(db, cfg: dict, classifier=None) -> LiveLeadScorer:
+    """
+    LiveLeadScorer с настройками из config.json. Бот, веб-сервер и
+    пересчет лидов (rescore_leads.py) собирают оценку этой функцией,
+    поэтому очки у них совпадают
+    """
+    return LiveLeadScorer(
+        db,
+        check_interval=float(cfg.get("scoring_rules_check_interval", 0.5)),
+        # Локальная модель по истории ответов (python lead_classifier.py)
+        classifier=classifier,
+        classifier_points=int(cfg.get("lead_model_points", 2)),
+        classifier_threshold=float(cfg.get("lead_model_threshold", 0.8)),
+    )
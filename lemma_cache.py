@@ -0,0 +1,212 @@
+"""
+Ограниченный кэш лемм с сохранением на диск.
+
+В памяти держится LRU-словарь "словоформа -> лемма" с лимитом по числу
+записей и по занимаемой памяти. При сохранении записи сбрасываются в
+компактный файл (отсортированный массив смещений + блок UTF-8), который
+при старте не разбирается, а отображается в память через mmap: поиск
+по нему — бинарный, так что перезапущенный бот сразу работает с теплым
+кэшем, не дожидаясь повторной разметки natasha.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+# Версия 2: файлы версии 1 записаны пакетной разметкой, в которой леммы
+# сообщений страницы зависели друг от друга, и при старте отбрасываются
+_MAGIC = b"LEMMAC2\0"
+_HEADER = struct.Struct("<8sI")
+_OFFSET = struct.Struct("<I")
+_SEP = b"\0"
+
+
+class LemmaCache:
+    """LRU-кэш лемм с лимитами и файлом для быстрого теплого старта"""
+
+    def __init__(self, max_entries: int = 200_000, max_bytes: int = 64 * 1024 * 1024,
+                 path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+
+        # Отображенный в память файл предыдущего запуска
+        self._file = None
+        self._mm = None
+        self._count = 0
+        self._blob_start = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self._open_file()
+
+    # ---------- память ----------
+    @staticmethod
+    def _entry_size(word: str, lemma: str) -> int:
+        return sys.getsizeof(word) + sys.getsizeof(lemma)
+
+    def _store(self, word: str, lemma: str):
+        old = self._data.pop(word, None)
+        if old is not None:
+            self._bytes -= self._entry_size(word, old)
+        self._data[word] = lemma
+        self._bytes += self._entry_size(word, lemma)
+
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            evicted_word, evicted_lemma = self._data.popitem(last=False)
+            self._bytes -= self._entry_size(evicted_word, evicted_lemma)
+            self.evictions += 1
+
+    def get(self, word: str, default=None):
+        lemma = self._data.get(word)
+        if lemma is not None:
+            self._data.move_to_end(word)
+            self.hits += 1
+            return lemma
+
+        lemma = self._disk_lookup(word)
+        if lemma is not None:
+            # Переносим в память, чтобы следующий поиск был O(1)
+            self._store(word, lemma)
+            self.disk_hits += 1
+            return lemma
+
+        self.misses += 1
+        return default
+
+    def __contains__(self, word: str) -> bool:
+        # Проверка без побочных эффектов: не трогает счетчики и порядок LRU
+        return word in self._data or self._disk_lookup(word) is not None
+
+    def __getitem__(self, word: str) -> str:
+        lemma = self.get(word)
+        if lemma is None:
+            raise KeyError(word)
+        return lemma
+
+    def __setitem__(self, word: str, lemma: str):
+        self._store(word, lemma or word)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Примерный объем памяти, занятый записями в RAM"""
+        return self._bytes
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._data),
+            'disk_entries': self._count,
+            'memory_bytes': self._bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    # ---------- файл ----------
+    def _open_file(self):
+        """Отображает файл кэша в память (без чтения содержимого)"""
+        if not self.path or not os.path.exists(self.path) or os.path.getsize(self.path) < _HEADER.size:
+            return
+        f = open(self.path, "rb")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            f.close()
+            return
+        magic, count = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC:
+            mm.close()
+            f.close()
+            return
+        self._file, self._mm, self._count = f, mm, count
+        self._blob_start = _HEADER.size + _OFFSET.size * (count + 1)
+
+    def _close_file(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._file = self._mm = None
+        self._count = 0
+
+    def _disk_record(self, i: int) -> Tuple[bytes, bytes]:
+        mm = self._mm
+        start = _OFFSET.unpack_from(mm, _HEADER.size + _OFFSET.size * i)[0]
+        end = _OFFSET.unpack_from(mm, _HEADER.size + _OFFSET.size * (i + 1))[0]
+        record = mm[self._blob_start + start:self._blob_start + end]
+        word, _, lemma = record.partition(_SEP)
+        return word, lemma
+
+    def _disk_lookup(self, word: str) -> Optional[str]:
+        """Бинарный поиск по отсортированным записям файла"""
+        if self._mm is None:
+            return None
+        key = word.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_word, lemma = self._disk_record(mid)
+            if mid_word < key:
+                lo = mid + 1
+            elif mid_word > key:
+                hi = mid
+            else:
+                return lemma.decode("utf-8")
+        return None
+
+    def _iter_disk(self) -> Iterator[Tuple[bytes, bytes]]:
+        for i in range(self._count if self._mm is not None else 0):
+            yield self._disk_record(i)
+
+    def save(self) -> int:
+        """
+        Сохраняет кэш в файл: записи из памяти (самые свежие) плюс записи
+        прошлого файла, всего не более max_entries. Возвращает число записей.
+        """
+        if not self.path:
+            return 0
+
+        entries = {}
+        for word, lemma in reversed(self._data.items()):
+            if len(entries) >= self.max_entries:
+                break
+            entries[word.encode("utf-8")] = lemma.encode("utf-8")
+        for word, lemma in self._iter_disk():
+            if len(entries) >= self.max_entries:
+                break
+            entries.setdefault(word, lemma)
+
+        offsets = []
+        blob = bytearray()
+        for word in sorted(entries):
+            offsets.append(len(blob))
+            blob += word + _SEP + entries[word]
+        offsets.append(len(blob))
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(entries)))
+            f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+            f.write(blob)
+
+        self._close_file()
+        os.replace(tmp_path, self.path)
+        self._open_file()
+        return len(entries)
+
+    def close(self):
+        self._close_file()
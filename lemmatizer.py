@@ -0,0 +1,171 @@
+"""
+Лемматизация текстов (natasha) с кэшем лемм.
+
+Модели natasha грузятся лениво — при первой лемматизации или явно через
+load(). Леммы словоформ хранятся в LemmaCache (см. lemma_cache.py),
+поэтому NewsMorphTagger размечает только тексты с новыми словоформами.
+Лемматизатор используют и бот, и веб-сервер, так что фразы по леммам
+у них находятся одинаково.
+
+Проверка, что леммы пачки совпадают с леммами сообщений по одному:
+    python lemmatizer.py [файл с сообщениями, по одному на строку]
+"""
+
+import logging
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from common import WORD_RE
+from lemma_cache import LemmaCache
+
+log = logging.getLogger("tg-scout")
+
+Tokens = List[Tuple[str, int, int]]
+
+
+def regex_tokens(s: str) -> Tokens:
+    """Слова текста в нижнем регистре с позициями (без лемматизации)"""
+    return [(m.group(), m.start(), m.end()) for m in WORD_RE.finditer(s.lower())]
+
+
+class Lemmatizer:
+    """Леммы слов с позициями; если natasha недоступна — просто слова в нижнем регистре"""
+
+    def __init__(self, cache: LemmaCache):
+        self.cache = cache
+        self.available = True
+        self._nlp = None
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> Optional["Lemmatizer"]:
+        """Лемматизатор по настройкам config.json; None, если use_natasha выключен"""
+        if not cfg.get("use_natasha", False):
+            return None
+        # Ограниченный кэш лемм; файл с прошлого запуска отображается в память
+        return cls(LemmaCache(
+            max_entries=int(cfg.get("lemma_cache_size", 200_000)),
+            max_bytes=int(cfg.get("lemma_cache_max_mb", 64)) * 1024 * 1024,
+            path=cfg.get("lemma_cache_file", "data/lemma_cache.bin"),
+        ))
+
+    def load(self) -> bool:
+        """Загружает модели natasha (один раз). Возвращает True, если лемматизация доступна"""
+        if not self.available:
+            return False
+        if self._nlp is not None:
+            return True
+        try:
+            from natasha import Segmenter, MorphVocab, NewsEmbedding, NewsMorphTagger, Doc
+            from razdel import tokenize
+            self._nlp = {
+                "doc": Doc,
+                "tokenize": tokenize,
+                "segmenter": Segmenter(),
+                "morph_vocab": MorphVocab(),
+                "tagger": NewsMorphTagger(NewsEmbedding()),
+            }
+            return True
+        except Exception as e:
+            log.warning(f"Natasha не загрузилась ({e}). Перехожу в быстрый режим.")
+            self.available = False
+            return False
+
+    def _word_tokens(self, s: str) -> Tokens:
+        """Слова текста без пунктуации: [(слово, start, stop), ...]"""
+        return [(tok.text, tok.start, tok.stop) for tok in self._nlp["tokenize"](s) if WORD_RE.search(tok.text)]
+
+    def _tag(self, texts: Sequence[str]) -> List[Dict[int, str]]:
+        """
+        Размечает несколько текстов одним вызовом NewsMorphTagger.
+        Возвращает леммы слов каждого текста по позиции начала слова;
+        леммы новых словоформ складываются в кэш.
+
+        Каждый текст делится на предложения отдельно: сегментатор не
+        считает пустую строку границей, и в общем документе соседние
+        сообщения стали бы одним предложением, а леммы зависели бы от
+        соседей по странице. В теггер уходят все предложения пачки сразу
+        """
+        nlp, cache = self._nlp, self.cache
+        sents = []
+        for i, text in enumerate(texts):
+            doc = nlp["doc"](text)
+            doc.segment(nlp["segmenter"])
+            sents.extend((i, sent) for sent in doc.sents)
+        lemmas: List[Dict[int, str]] = [{} for _ in texts]
+        markups = nlp["tagger"].map([[t.text for t in sent.tokens] for _, sent in sents])
+        for (i, sent), markup in zip(sents, markups):
+            for t, tagged in zip(sent.tokens, markup.tokens):
+                if not WORD_RE.search(t.text):
+                    continue
+                t.pos, t.feats = tagged.pos, tagged.feats
+                t.lemmatize(nlp["morph_vocab"])
+                lemmas[i][t.start] = t.lemma
+                if t.text not in cache:
+                    cache[t.text] = t.lemma
+        return lemmas
+
+    def tokens_batch(self, texts: Sequence[str]) -> List[Tokens]:
+        """
+        Леммы для пачки текстов: [[(лемма, start, stop), ...], ...].
+        Тексты, все слова которых уже в кэше, не размечаются вовсе,
+        остальные размечаются вместе за один проход и получают леммы
+        своей разметки — те же, что и при разметке по одному.
+        """
+        if not self.load():
+            return [regex_tokens(t) for t in texts]
+
+        cache = self.cache
+        lowered = [t.lower() for t in texts]
+        words = [self._word_tokens(t) for t in lowered]
+        cold = [i for i, ws in enumerate(words) if any(w not in cache for w, _, _ in ws)]
+        tagged = dict(zip(cold, self._tag([lowered[i] for i in cold]))) if cold else {}
+        result = []
+        for i, ws in enumerate(words):
+            own = tagged.get(i, {})
+            result.append([(own.get(a) or cache.get(w, w), a, b) for w, a, b in ws])
+        return result
+
+    def tokens(self, s: str) -> Tokens:
+        """Леммы слов текста с позициями: [(лемма, start, stop), ...]"""
+        return self.tokens_batch([s])[0]
+
+
+def batch_mismatches(lemmatizer: Lemmatizer, texts: Sequence[str]) -> List[Tuple[str, list, list]]:
+    """
+    Тексты, леммы которых в пачке отличаются от разметки по одному:
+    [(текст, леммы в пачке, леммы по одному), ...]. Кэш лемм не используется
+    """
+    batch = Lemmatizer(LemmaCache())
+    batch._nlp = lemmatizer._nlp
+    batched = batch.tokens_batch(texts)
+    mismatches = []
+    for text, tokens in zip(texts, batched):
+        single = Lemmatizer(LemmaCache())
+        single._nlp = lemmatizer._nlp
+        alone = single.tokens(text)
+        if tokens != alone:
+            mismatches.append((text, [w for w, _, _ in tokens], [w for w, _, _ in alone]))
+    return mismatches
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            sample = [line.strip() for line in f if line.strip()]
+    else:
+        sample = [
+            "Кто снимает свадьбы в Москве",
+            "Ищем видеографов на свадьбу, бюджет 50к, срочно!!",
+            "Нужен монтажер для рекламного ролика",
+            "Ищу видеопродюсера для YouTube канала про путешествия",
+        ]
+    lemmatizer = Lemmatizer(LemmaCache())
+    if not lemmatizer.load():
+        sys.exit("natasha не загрузилась")
+    found = batch_mismatches(lemmatizer, sample)
+    for text, batched, alone in found:
+        log.error(f"❌ {text}: в пачке {batched}, по одному {alone}")
+    log.info(f"✅ Леммы пачки совпадают с разметкой по одному ({len(sample)} сообщений)" if not found
+             else f"❌ Расхождений: {len(found)} из {len(sample)}")
+    sys.exit(1 if found else 0)
@@ -178,6 +178,26 @@ def run_web_server_process():
         print(f"❌ Ошибка запуска веб-сервера: {e}")
         return None
 
+def wait_for_web_server(timeout=10.0, interval=0.25):
+    """Опрашивает веб-сервер, пока он не ответит (вместо фиксированной паузы)"""
+    import urllib.request
+    import urllib.error
+    
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            with urllib.request.urlopen('http://localhost:8080', timeout=1):
+                print(f"✅ Веб-сервер запущен успешно за {time.monotonic() - started:.1f} с")
+                return True
+        except urllib.error.HTTPError as e:
+            print(f"⚠️ Веб-сервер отвечает с кодом {e.code}")
+            return True
+        except Exception:
+            time.sleep(interval)
+    
+    print("⚠️ Веб-сервер пока недоступен")
+    return False
+
 def monitor_process(process, name):
     """Мониторинг процесса"""
     while True:
@@ -227,26 +247,16 @@ def run_combined_system():
             print("❌ Не удалось запустить веб-сервер")
             return
         
-        print("⏳ Ждем запуска веб-сервера...")
-        time.sleep(5)
-        
-        # Проверяем что веб-сервер запустился
-        try:
-            import requests
-            response = requests.get('http://localhost:8080', timeout=5)
-            if response.status_code == 200:
-                print("✅ Веб-сервер запущен успешно")
-            else:
-                print(f"⚠️ Веб-сервер отвечает с кодом {response.status_code}")
-        except:
-            print("⚠️ Веб-сервер пока недоступен")
-        
-        # Запускаем Telegram бота
+        # Telegram бот не зависит от веб-сервера, поэтому запускаем его
+        # сразу, а готовность веб-сервера проверяем параллельно
         telegram_process = run_telegram_bot_process()
         if not telegram_process:
             print("❌ Не удалось запустить Telegram бота")
             return
         
+        print("⏳ Ждем запуска веб-сервера...")
+        wait_for_web_server()
+        
         print("🎉 Система запущена!")
         print("📊 Веб-интерфейс: http://localhost:8080")
         print("🤖 Telegram бот: запущен в отдельном процессе")
@@ -0,0 +1,137 @@
+"""
+Поиск почти одинаковых сообщений (кросспостинг заказов по чатам).
+
+Для каждого текста считается MinHash-подпись по множеству слов и пар
+соседних слов: доля совпавших позиций двух подписей оценивает меру
+Жаккара этих множеств, поэтому мелкие правки (дата, "в лс" вместо
+"в личку") почти не меняют подпись. Подписи за последнее окно времени
+лежат в LSH-корзинах по полосам: кандидатами в дубликаты становятся
+только сообщения, совпавшие с новым хотя бы в одной полосе целиком,
+и лишь с ними сравнивается полная подпись.
+"""
+
+import threading
+import zlib
+from collections import deque
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from common import WORD_RE
+
+
+def shingles(text: str) -> List[str]:
+    """Слова и пары соседних слов текста"""
+    words = WORD_RE.findall((text or "").lower().replace("ё", "е"))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class MinHasher:
+    """MinHash на универсальных хеш-функциях вида (a*x + b) >> 32"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, features: List[str]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in set(features)),
+                             dtype=np.uint64)
+        # Умножение по модулю 2^64 (переполнение uint64 ожидаемо)
+        with np.errstate(over="ignore"):
+            mixed = (hashes[:, None] * self._a + self._b) >> np.uint64(32)
+        return mixed.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """Скользящее окно MinHash-подписей с LSH-корзинами"""
+
+    def __init__(self, window_seconds: float = 24 * 3600, threshold: float = 0.5,
+                 min_words: int = 5, num_perm: int = 64, bands: int = 16,
+                 max_entries: int = 100_000):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.window_seconds = window_seconds
+        self.threshold = threshold
+        self.min_words = min_words
+        self.bands = bands
+        self.max_entries = max_entries
+        self._rows = num_perm // bands
+        self._hasher = MinHasher(num_perm)
+
+        # id записи -> (время, подпись, id лида, ключи корзин)
+        self._entries: Dict[int, Tuple[float, np.ndarray, int, List[tuple]]] = {}
+        self._order: deque = deque()
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Подпись текста или None, если в нем меньше min_words слов"""
+        features = shingles(text)
+        if (len(features) + 1) // 2 < self.min_words:
+            return None
+        return self._hasher.signature(features)
+
+    def _keys(self, sig: np.ndarray) -> List[tuple]:
+        rows = self._rows
+        return [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def _evict(self, now: float):
+        # При сканировании истории время идет не по порядку, поэтому
+        # окно дополнительно ограничено числом записей
+        border = now - self.window_seconds
+        while self._order:
+            entry_id = self._order[0]
+            added_at, _, _, keys = self._entries[entry_id]
+            if added_at >= border and len(self._order) < self.max_entries:
+                break
+            self._order.popleft()
+            del self._entries[entry_id]
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.remove(entry_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find(self, text: str, timestamp: float) -> Optional[int]:
+        """id лида, почти совпадающего с текстом в пределах окна, или None"""
+        sig = self.signature(text)
+        if sig is None:
+            return None
+        with self._lock:
+            self._evict(timestamp)
+            candidates = set()
+            for key in self._keys(sig):
+                candidates.update(self._buckets.get(key, ()))
+
+            best = None
+            for entry_id in candidates:
+                added_at, other, lead_id, _ = self._entries[entry_id]
+                if abs(timestamp - added_at) > self.window_seconds:
+                    continue
+                similarity = float(np.count_nonzero(sig == other)) / len(sig)
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, lead_id)
+            return best[1] if best else None
+
+    def add(self, text: str, lead_id: int, timestamp: float) -> bool:
+        """Запоминает текст лида. Возвращает False для слишком коротких текстов"""
+        sig = self.signature(text)
+        if sig is None:
+            return False
+        keys = self._keys(sig)
+        with self._lock:
+            self._evict(timestamp)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (timestamp, sig, lead_id, keys)
+            self._order.append(entry_id)
+            for key in keys:
+                self._buckets.setdefault(key, []).append(entry_id)
+        return True
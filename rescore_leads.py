@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Пересчет оценок всех лидов после изменения правил оценки.
+
+Таблица leads читается порциями по id (keyset-пагинация, без OFFSET),
+каждая порция оценивается одним проходом LeadScorer, а изменившиеся
+оценки записываются одной транзакцией на порцию. Блокировка базы
+берется только на время отдельного чтения или записи, поэтому
+работающий бот не простаивает. В конце пересчитывается daily_stats.
+"""
+
+import argparse
+import json
+import time
+
+from shared_db import db
+from lead_classifier import DEFAULT_MODEL_FILE, LeadClassifier
+from lead_scoring import LeadScorer, live_lead_scorer
+
+
+def load_config(path: str = "config.json") -> dict:
+    """Настройки из config.json (те же, что у бота и веб-сервера)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def rescore_leads(scorer: LeadScorer = None, chunk_size: int = 5000,
+                  report_every: float = 2.0, model_file: str = None) -> dict:
+    """
+    Пересчитывает оценки всех лидов и статистику. Возвращает сводку.
+    По умолчанию используются текущие правила из таблицы scoring_rules
+    и модель лидов (model_file или lead_model_file из config.json), если
+    она обучена, с теми же настройками модели, что у бота
+    """
+    if scorer is None:
+        cfg = load_config()
+        model_file = model_file or cfg.get("lead_model_file", DEFAULT_MODEL_FILE)
+        scorer = live_lead_scorer(db, cfg, LeadClassifier.load(model_file))
+    started = time.perf_counter()
+    last_report = started
+    last_id = 0
+    total = changed = 0
+    encoded = {}
+
+    while True:
+        rows = db.get_leads_chunk(last_id, chunk_size)
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        results = scorer.score_batch([row[1] for row in rows])
+        updates = []
+        for (lead_id, _, old_score, old_label, old_reasons), result in zip(rows, results):
+            key = tuple(result['reasons'])
+            reasons = encoded.get(key)
+            if reasons is None:
+                reasons = encoded[key] = json.dumps(result['reasons'], ensure_ascii=False)
+            if (old_score, old_label, old_reasons) != (result['score'], result['quality'], reasons):
+                updates.append((result['score'], result['quality'], reasons, lead_id))
+        db.update_lead_scores(updates)
+
+        total += len(rows)
+        changed += len(updates)
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            last_report = now
+            print(f"⏳ Пересчитано {total} лидов (изменено {changed}), "
+                  f"{total / (now - started):.0f} лидов/с, последний id={last_id}")
+
+    days = db.rebuild_daily_stats()
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Пересчет завершен: {total} лидов, изменено {changed}, "
+          f"дней в статистике {days}, {elapsed:.2f} с ({rate:.0f} лидов/с)")
+    return {'total': total, 'changed': changed, 'days': days, 'seconds': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет оценок лидов по текущим правилам")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Размер порции (по умолчанию 5000)")
+    parser.add_argument("--model", help="Файл модели лидов (по умолчанию lead_model_file из config.json)")
+    args = parser.parse_args()
+    rescore_leads(chunk_size=args.chunk_size, model_file=args.model)
+
+
+if __name__ == "__main__":
+    main()
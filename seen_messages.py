@@ -0,0 +1,78 @@
+"""
+Фильтр уже обработанных сообщений.
+
+id сообщений внутри одного чата идут подряд, поэтому для каждого чата
+хранится битовая карта от наименьшего увиденного id: один бит на
+сообщение, проверка — одна операция над bytearray. Карта заполняется
+при старте из leads (chat_id, message_id) и пополняется по мере
+сохранения новых лидов, так что повторное сканирование истории после
+перезапуска отбрасывает уже пересланные сообщения до поиска и оценки.
+"""
+
+import threading
+from typing import Dict, Iterable, Tuple
+
+
+class _Bitmap:
+    """Битовая карта id сообщений одного чата, начиная с base"""
+
+    __slots__ = ("base", "bits")
+
+    def __init__(self, first_id: int):
+        # base кратен 8, чтобы сдвиг карты был сдвигом целых байтов
+        self.base = first_id & ~7
+        self.bits = bytearray()
+
+    def __contains__(self, message_id: int) -> bool:
+        offset = message_id - self.base
+        if offset < 0:
+            return False
+        byte = offset >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (offset & 7)))
+
+    def add(self, message_id: int):
+        if message_id < self.base:
+            new_base = message_id & ~7
+            self.bits[0:0] = bytes((self.base - new_base) >> 3)
+            self.base = new_base
+        offset = message_id - self.base
+        byte = offset >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (offset & 7)
+
+
+class SeenMessages:
+    """Множество пар (чат, id сообщения) на битовых картах"""
+
+    def __init__(self, pairs: Iterable[Tuple[int, int]] = ()):
+        self._chats: Dict[int, _Bitmap] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        for chat_id, message_id in pairs:
+            self.add(chat_id, message_id)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        chat_id, message_id = key
+        bitmap = self._chats.get(chat_id)
+        return bitmap is not None and message_id in bitmap
+
+    def add(self, chat_id: int, message_id: int) -> bool:
+        """Отмечает сообщение. Возвращает False, если оно уже было отмечено"""
+        if chat_id is None or message_id is None:
+            return False
+        with self._lock:
+            bitmap = self._chats.get(chat_id)
+            if bitmap is None:
+                bitmap = self._chats[chat_id] = _Bitmap(message_id)
+            elif message_id in bitmap:
+                return False
+            bitmap.add(message_id)
+            self._count += 1
+            return True
+
+    def memory_bytes(self) -> int:
+        return sum(len(b.bits) for b in self._chats.values())
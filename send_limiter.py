@@ -0,0 +1,134 @@
+"""
+Общий ограничитель исходящих сообщений Telegram.
+
+Все отправки аккаунта (карточки, пересылки, автоответы, уведомления)
+проходят через токен-бакеты: один общий и по одному на получателя.
+При FloodWaitError отправки приостанавливаются на указанное Telegram
+время, а скорость всех бакетов уменьшается вдвое; после каждой удачной
+отправки она понемногу восстанавливается (AIMD), так что ограничитель
+сам держится чуть ниже предела, который терпит аккаунт.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from telethon.errors import rpcerrorlist
+
+log = logging.getLogger("tg-scout")
+
+
+class TokenBucket:
+    """Бакет на rate токенов в секунду с запасом capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float, factor: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait_time(self, now: float, factor: float = 1.0) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self._refill(now, factor)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / (self.rate * factor)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class SendLimiter:
+    """Токен-бакеты на аккаунт и на получателя с адаптацией к FloodWait"""
+
+    def __init__(self, global_rate: float = 1.0, global_burst: int = 5,
+                 per_destination_rate: float = 0.33, per_destination_burst: int = 3,
+                 min_factor: float = 0.1, recovery_step: float = 0.02,
+                 max_flood_wait: float = 3600, max_retries: int = 3):
+        self.per_destination_rate = per_destination_rate
+        self.per_destination_burst = per_destination_burst
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_burst)
+        self._destinations: Dict[Hashable, TokenBucket] = {}
+        self._factor = 1.0
+        self._blocked_until = 0.0
+        self._waiting = 0
+        self.sent = 0
+        self.floods = 0
+
+    def _bucket(self, destination: Hashable) -> TokenBucket:
+        bucket = self._destinations.get(destination)
+        if bucket is None:
+            bucket = self._destinations[destination] = TokenBucket(
+                self.per_destination_rate, self.per_destination_burst)
+        return bucket
+
+    async def acquire(self, destination: Hashable):
+        """Ждет, пока отправка получателю уложится в оба бакета"""
+        bucket = self._bucket(destination)
+        self._waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(self._blocked_until - now,
+                           self._global.wait_time(now, self._factor),
+                           bucket.wait_time(now, self._factor))
+                if wait <= 0:
+                    self._global.take()
+                    bucket.take()
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting -= 1
+
+    def on_flood(self, seconds: float):
+        """FloodWait: пауза для всего аккаунта и снижение скорости вдвое"""
+        self.floods += 1
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._factor = max(self.min_factor, self._factor / 2)
+        log.warning(f"🚧 FloodWait {seconds} с: отправки на паузе, скорость {self.rate:.2f} сообщ/с")
+
+    def on_success(self):
+        self.sent += 1
+        self._factor = min(1.0, self._factor + self.recovery_step)
+
+    async def call(self, destination: Hashable, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет отправку под ограничителем, повторяя её после FloodWait"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(destination)
+            try:
+                result = await send()
+            except rpcerrorlist.FloodWaitError as e:
+                self.on_flood(e.seconds)
+                if e.seconds > self.max_flood_wait or attempt == self.max_retries:
+                    raise
+                continue
+            self.on_success()
+            return result
+
+    @property
+    def rate(self) -> float:
+        """Текущая общая скорость, сообщений в секунду"""
+        return self._global.rate * self._factor
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'rate': round(self.rate, 3),
+            'factor': round(self._factor, 3),
+            'backlog': self._waiting,
+            'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            'sent': self.sent,
+            'floods': self.floods,
+            'destinations': len(self._destinations),
+        }
@@ -0,0 +1,107 @@
+"""
+Кэш профилей авторов сообщений.
+
+message.get_sender() идет в сеть, если автора нет среди сущностей,
+пришедших вместе с сообщением, а одни и те же заказчики пишут снова
+и снова. Профиль (имя, username, признак бота) хранится по id автора
+в LRU-словаре с TTL; по возможности он заполняется из сущностей
+апдейта (message.sender), и сеть используется только для новых авторов.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from telethon.errors import rpcerrorlist
+from telethon.tl.types import User
+
+
+class SenderProfile(NamedTuple):
+    id: int
+    first_name: str
+    last_name: str
+    username: Optional[str]
+    bot: bool
+    is_user: bool
+
+    @property
+    def full_name(self) -> str:
+        return " ".join(p for p in (self.first_name, self.last_name) if p)
+
+
+def sender_profile(sender) -> Optional[SenderProfile]:
+    """Профиль из сущности Telethon (пользователь, канал или чат)"""
+    if sender is None:
+        return None
+    if isinstance(sender, User):
+        return SenderProfile(sender.id, sender.first_name or "", sender.last_name or "",
+                             sender.username, bool(sender.bot), True)
+    return SenderProfile(sender.id, getattr(sender, "title", None) or "", "",
+                         getattr(sender, "username", None), False, False)
+
+
+class SenderCache:
+    """LRU-кэш профилей авторов с ограничением по времени жизни"""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600, max_flood_wait: float = 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_flood_wait = max_flood_wait
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, sender_id: int) -> Optional[SenderProfile]:
+        with self._lock:
+            item = self._items.get(sender_id)
+            if item is None:
+                return None
+            stored_at, profile = item
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._items[sender_id]
+                return None
+            self._items.move_to_end(sender_id)
+            return profile
+
+    def remember(self, sender) -> Optional[SenderProfile]:
+        """Сохраняет профиль сущности; min-сущности без полных данных пропускаются"""
+        profile = sender_profile(sender)
+        if profile is None or getattr(sender, "min", False):
+            return profile
+        with self._lock:
+            self._items[profile.id] = (time.monotonic(), profile)
+            self._items.move_to_end(profile.id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return profile
+
+    async def profile(self, message) -> Optional[SenderProfile]:
+        """Профиль автора сообщения: из кэша, из сущностей апдейта или из сети"""
+        sender_id = message.sender_id
+        if sender_id is None:
+            return None
+        cached = self.get(sender_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        sender = message.sender
+        if sender is None or getattr(sender, "min", False):
+            self.misses += 1
+            try:
+                sender = await message.get_sender()
+            except rpcerrorlist.FloodWaitError as e:
+                # Клиент не спит на FloodWait сам: короткий ждем, при долгом
+                # обходимся тем, что пришло с сообщением
+                if e.seconds > self.max_flood_wait:
+                    return sender_profile(sender)
+                await asyncio.sleep(e.seconds + 1)
+                sender = await message.get_sender()
+        else:
+            self.hits += 1
+        return self.remember(sender)
@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Any
 import threading
 
+from lead_scoring import NEGATIVE_SIGNALS, POSITIVE_SIGNALS
+
 class SharedDatabase:
     """Единая база данных для Telegram бота и веб-интерфейса"""
     
@@ -57,6 +59,19 @@ class SharedDatabase:
                 )
             ''')
             
+            # Таблица исключающих фраз: сообщения с ними отбрасываются
+            # до сохранения и пересылки (например, соискатели и реклама)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS negative_keywords (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phrase TEXT UNIQUE NOT NULL,
+                    active BOOLEAN DEFAULT TRUE,
+                    hits_count INTEGER DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    last_hit_at DATETIME
+                )
+            ''')
+            
             # Таблица источников чатов
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS chat_sources (
@@ -112,6 +127,76 @@ class SharedDatabase:
                 )
             ''')
             
+            # Кэш разрешенных сущностей Telegram (по аккаунту и исходной ссылке)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS entity_cache (
+                    account TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    kind TEXT NOT NULL, -- 'chat', 'channel', 'user'
+                    entity_id INTEGER NOT NULL,
+                    access_hash INTEGER,
+                    title TEXT,
+                    username TEXT,
+                    megagroup BOOLEAN DEFAULT FALSE,
+                    broadcast BOOLEAN DEFAULT FALSE,
+                    resolved_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (account, ref)
+                )
+            ''')
+            
+            # Таблица правил оценки лидов (сигнал, очки, причина).
+            # При первом создании заполняется правилами по умолчанию
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scoring_rules'")
+            seed_rules = cursor.fetchone() is None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scoring_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    signal TEXT UNIQUE NOT NULL,
+                    points INTEGER NOT NULL,
+                    reason TEXT,
+                    active BOOLEAN DEFAULT TRUE,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            if seed_rules:
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO scoring_rules (signal, points, reason) VALUES (?, ?, ?)',
+                    POSITIVE_SIGNALS + NEGATIVE_SIGNALS
+                )
+            
+            # Счетчики версий таблиц: позволяют держать данные в памяти
+            # процесса и перечитывать их только после изменений
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            self._create_version_triggers(cursor, 'keywords', ['phrase', 'active'])
+            self._create_version_triggers(cursor, 'negative_keywords', ['phrase', 'active'])
+            self._create_version_triggers(cursor, 'scoring_rules', ['signal', 'points', 'reason', 'active'])
+            # Список наблюдаемых чатов меняется только добавлением, удалением,
+            # переименованием ключа или (де)активацией; счетчики лидов и курсоры версию не трогают
+            self._create_version_triggers(cursor, 'chat_sources', ['chat_id', 'active'])
+            
+            # Столбцы, добавленные после создания таблиц
+            self._ensure_column(cursor, 'leads', 'duplicate_of', 'INTEGER REFERENCES leads(id)')
+            self._ensure_column(cursor, 'leads', 'chat_id', 'INTEGER')
+            # Курсор сканирования истории: последнее обработанное сообщение чата
+            self._ensure_column(cursor, 'chat_sources', 'last_message_id', 'INTEGER')
+            self._ensure_column(cursor, 'chat_sources', 'last_message_date', 'DATETIME')
+            # Ссылка, по которой чат добавлен, после перевода строки на ключ чата
+            self._ensure_column(cursor, 'chat_sources', 'source_ref', 'TEXT')
+            # Аккаунт не состоит в чате (обновления из него не приходят)
+            self._ensure_column(cursor, 'entity_cache', 'left', 'BOOLEAN DEFAULT FALSE')
+            
+            # Одно сообщение чата сохраняется не больше одного раза
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_chat_message
+                ON leads(chat_id, message_id)
+                WHERE chat_id IS NOT NULL AND message_id IS NOT NULL
+            ''')
+            
             # Индексы для производительности
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_leads_timestamp ON leads(timestamp)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_leads_quality ON leads(quality_score)')
@@ -123,10 +208,48 @@ class SharedDatabase:
             conn.close()
             print(f"✅ Общая база данных инициализирована: {self.db_path}")
     
+    @staticmethod
+    def _create_version_triggers(cursor, table: str, columns: List[str] = None):
+        """Создает триггеры, увеличивающие версию таблицы при любом изменении"""
+        cursor.execute('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)', (table,))
+        update_of = f" OF {', '.join(columns)}" if columns else ""
+        for suffix, event in (('ins', 'INSERT'), ('upd', f'UPDATE{update_of}'), ('del', 'DELETE')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{suffix}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+    
+    @staticmethod
+    def _ensure_column(cursor, table: str, column: str, definition: str):
+        """Добавляет столбец в существующую таблицу, если его еще нет"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def get_table_version(self, table: str) -> int:
+        """Возвращает текущую версию таблицы (растет при каждом изменении)"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT version FROM table_versions WHERE name = ?', (table,))
+            row = cursor.fetchone()
+            
+            conn.close()
+            return row[0] if row else 0
+    
     def add_lead(self, chat_source: str, sender_id: int,
                  sender_name: str, message_text: str, quality_score: int,
-                 quality_label: str, quality_reasons: List[str] = None, chat_name: str = None) -> int:
-        """Добавляет новый лид в базу"""
+                 quality_label: str, quality_reasons: List[str] = None, chat_name: str = None,
+                 duplicate_of: int = None, chat_id: int = None, message_id: int = None) -> int:
+        """
+        Добавляет новый лид в базу.
+        duplicate_of — id лида, копией которого является сообщение (в статистику не входит).
+        Если сообщение (chat_id, message_id) уже сохранено, возвращает 0
+        """
         with self.lock:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -138,21 +261,38 @@ class SharedDatabase:
             
             cursor.execute('''
                 INSERT INTO leads (chat_source, chat_title, sender_id, sender_name, 
-                                 message_text, quality_score, quality_label, quality_reasons)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                 message_text, quality_score, quality_label, quality_reasons,
+                                 duplicate_of, chat_id, message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, message_id) WHERE chat_id IS NOT NULL AND message_id IS NOT NULL
+                DO NOTHING
             ''', (chat_source, chat_name, sender_id, sender_name,
-                  message_text, quality_score, quality_label, reasons_str))
+                  message_text, quality_score, quality_label, reasons_str, duplicate_of,
+                  chat_id, message_id))
+            
+            if cursor.rowcount == 0:
+                conn.close()
+                print(f"⏭️ Сообщение {chat_id}/{message_id} уже сохранено")
+                return 0
             
             lead_id = cursor.lastrowid
             
+            if duplicate_of:
+                conn.commit()
+                conn.close()
+                print(f"♻️ Дубликат лида {duplicate_of} сохранен: ID={lead_id}")
+                return lead_id
+            
             # Обновляем статистику чата
+            # (UPSERT, а не REPLACE: иначе сотрутся курсор сканирования и прочие поля)
             cursor.execute('''
-                INSERT OR REPLACE INTO chat_sources (chat_id, chat_name, active, 
-                                                    leads_count, last_lead_time)
-                VALUES (?, ?, TRUE, 
-                       COALESCE((SELECT leads_count FROM chat_sources WHERE chat_id = ?), 0) + 1,
-                       ?)
-            ''', (chat_source, chat_name, chat_source, datetime.now()))
+                INSERT INTO chat_sources (chat_id, chat_name, active, leads_count, last_lead_time)
+                VALUES (?, ?, TRUE, 1, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    chat_name = excluded.chat_name,
+                    leads_count = leads_count + 1,
+                    last_lead_time = excluded.last_lead_time
+            ''', (chat_source, chat_name, datetime.now()))
             
             # Обновляем дневную статистику
             today = datetime.now().date()
@@ -176,6 +316,121 @@ class SharedDatabase:
             print(f"💾 Лид добавлен в БД: ID={lead_id}, качество={quality_label}")
             return lead_id
     
+    def get_leads_chunk(self, after_id: int = 0, limit: int = 5000) -> List[tuple]:
+        """
+        Порция лидов для пересчета оценок (keyset-пагинация по id).
+        Возвращает [(id, message_text, quality_score, quality_label, quality_reasons), ...]
+        """
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, message_text, quality_score, quality_label, quality_reasons
+                FROM leads
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, limit))
+            rows = cursor.fetchall()
+            
+            conn.close()
+            return rows
+    
+    def update_lead_scores(self, updates: List[tuple]):
+        """
+        Записывает новые оценки одной транзакцией.
+        updates: [(quality_score, quality_label, quality_reasons_json, id), ...]
+        """
+        if not updates:
+            return
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                UPDATE leads
+                SET quality_score = ?, quality_label = ?, quality_reasons = ?
+                WHERE id = ?
+            ''', updates)
+            
+            conn.commit()
+            conn.close()
+    
+    def rebuild_daily_stats(self) -> int:
+        """
+        Пересчитывает счетчики лидов в daily_stats по текущим оценкам в leads.
+        Счетчики ответов не трогаются. Возвращает число дней со статистикой.
+        """
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE daily_stats
+                SET total_leads = 0, hot_leads = 0, good_leads = 0,
+                    normal_leads = 0, low_quality_leads = 0
+            ''')
+            # timestamp хранится в UTC, а add_lead пишет локальную дату
+            cursor.execute('''
+                INSERT INTO daily_stats (date, total_leads, hot_leads, good_leads, normal_leads, low_quality_leads)
+                SELECT DATE(timestamp, 'localtime'),
+                       COUNT(*),
+                       SUM(quality_score >= 5),
+                       SUM(quality_score >= 2 AND quality_score < 5),
+                       SUM(quality_score >= 0 AND quality_score < 2),
+                       SUM(quality_score < 0)
+                FROM leads
+                WHERE duplicate_of IS NULL
+                GROUP BY DATE(timestamp, 'localtime')
+                ON CONFLICT(date) DO UPDATE SET
+                    total_leads = excluded.total_leads,
+                    hot_leads = excluded.hot_leads,
+                    good_leads = excluded.good_leads,
+                    normal_leads = excluded.normal_leads,
+                    low_quality_leads = excluded.low_quality_leads
+            ''')
+            days = cursor.rowcount
+            
+            conn.commit()
+            conn.close()
+            return days
+    
+    def get_seen_messages(self) -> List[tuple]:
+        """Пары (chat_id, message_id) всех сохраненных сообщений"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT chat_id, message_id FROM leads
+                WHERE chat_id IS NOT NULL AND message_id IS NOT NULL
+            ''')
+            rows = cursor.fetchall()
+            
+            conn.close()
+            return rows
+    
+    def get_lead_texts_since(self, seconds_back: float) -> List[tuple]:
+        """
+        Тексты лидов (без дубликатов) за последние seconds_back секунд:
+        [(id, message_text, timestamp UTC), ...] в порядке добавления
+        """
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, message_text, timestamp
+                FROM leads
+                WHERE timestamp >= DATETIME('now', ?) AND duplicate_of IS NULL
+                ORDER BY id
+            ''', (f"-{int(seconds_back)} seconds",))
+            rows = cursor.fetchall()
+            
+            conn.close()
+            return rows
+    
     def get_recent_leads(self, limit: int = 10, hours_back: int = 24) -> List[Dict[str, Any]]:
         """Получает последние лиды"""
         with self.lock:
@@ -318,6 +573,133 @@ class SharedDatabase:
             conn.commit()
             conn.close()
     
+    def add_keyword_hits(self, hits: Dict[str, Any], table: str = 'keywords'):
+        """
+        Пакетно увеличивает счетчики попаданий одной транзакцией.
+        hits: {фраза: (количество, время последнего попадания)}
+        table: 'keywords' или 'negative_keywords'
+        """
+        if not hits:
+            return
+        if table not in ('keywords', 'negative_keywords'):
+            raise ValueError(f"Неизвестная таблица фраз: {table}")
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.executemany(f'''
+                UPDATE {table}
+                SET hits_count = hits_count + ?,
+                    last_hit_at = MAX(COALESCE(last_hit_at, ''), ?)
+                WHERE phrase = ?
+            ''', [(count, last_hit_at, phrase) for phrase, (count, last_hit_at) in hits.items()])
+            
+            conn.commit()
+            conn.close()
+    
+    def add_negative_keyword(self, phrase: str) -> bool:
+        """Добавляет исключающую фразу"""
+        with self.lock:
+            try:
+                conn = sqlite3.connect(self.db_path)
+                cursor = conn.cursor()
+                
+                cursor.execute('INSERT INTO negative_keywords (phrase) VALUES (?)', (phrase.lower().strip(),))
+                conn.commit()
+                conn.close()
+                return True
+            except sqlite3.IntegrityError:
+                conn.close()
+                return False
+    
+    def remove_negative_keyword(self, phrase: str) -> bool:
+        """Удаляет исключающую фразу"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM negative_keywords WHERE phrase = ?', (phrase.lower().strip(),))
+            affected = cursor.rowcount
+            
+            conn.commit()
+            conn.close()
+            
+            return affected > 0
+    
+    def get_negative_keywords(self, active_only: bool = True) -> List[str]:
+        """Получает список исключающих фраз"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            if active_only:
+                cursor.execute('SELECT phrase FROM negative_keywords WHERE active = 1 ORDER BY hits_count DESC, phrase')
+            else:
+                cursor.execute('SELECT phrase FROM negative_keywords ORDER BY hits_count DESC, phrase')
+            
+            phrases = [row[0] for row in cursor.fetchall()]
+            
+            conn.close()
+            return phrases
+    
+    def get_scoring_rules(self, active_only: bool = True) -> List[Dict[str, Any]]:
+        """Получает правила оценки лидов"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            query = 'SELECT id, signal, points, reason, active FROM scoring_rules'
+            if active_only:
+                query += ' WHERE active = 1'
+            cursor.execute(query + ' ORDER BY id')
+            
+            rules = []
+            for row in cursor.fetchall():
+                rules.append({
+                    'id': row[0],
+                    'signal': row[1],
+                    'points': row[2],
+                    'reason': row[3],
+                    'active': bool(row[4])
+                })
+            
+            conn.close()
+            return rules
+    
+    def set_scoring_rule(self, signal: str, points: int, reason: str = None, active: bool = True):
+        """Добавляет или изменяет правило оценки"""
+        signal = signal.lower().strip()
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO scoring_rules (signal, points, reason, active, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(signal) DO UPDATE SET
+                    points = excluded.points,
+                    reason = excluded.reason,
+                    active = excluded.active,
+                    updated_at = excluded.updated_at
+            ''', (signal, int(points), reason or signal, bool(active), datetime.now()))
+            
+            conn.commit()
+            conn.close()
+    
+    def remove_scoring_rule(self, signal: str) -> bool:
+        """Удаляет правило оценки"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM scoring_rules WHERE signal = ?', (signal.lower().strip(),))
+            affected = cursor.rowcount
+            
+            conn.commit()
+            conn.close()
+            
+            return affected > 0
+    
     def add_pending_response(self, lead_id: int, ai_response: str) -> int:
         """Добавляет отложенный ответ"""
         with self.lock:
@@ -445,6 +827,97 @@ class SharedDatabase:
             conn.close()
             return sources
     
+    def get_scan_cursor(self, chat_id: str) -> int:
+        """id последнего обработанного сообщения чата (0, если чат еще не сканировался)"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT last_message_id FROM chat_sources WHERE chat_id = ?', (chat_id,))
+            row = cursor.fetchone()
+            
+            conn.close()
+            return (row[0] or 0) if row else 0
+    
+    def advance_scan_cursor(self, chat_id: str, chat_name: str, last_message_id: int,
+                            last_message_date: datetime = None):
+        """
+        Сдвигает курсор сканирования чата вперед (назад он не двигается)
+        и отмечает время сканирования
+        """
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO chat_sources (chat_id, chat_name, last_message_id, last_message_date, last_scan_time)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    last_message_date = CASE
+                        WHEN excluded.last_message_id > COALESCE(last_message_id, 0)
+                        THEN excluded.last_message_date ELSE last_message_date END,
+                    last_message_id = MAX(COALESCE(last_message_id, 0), excluded.last_message_id),
+                    last_scan_time = excluded.last_scan_time
+            ''', (chat_id, chat_name or chat_id, last_message_id, last_message_date, datetime.now()))
+            
+            conn.commit()
+            conn.close()
+    
+    def get_cached_entity(self, account: str, ref: str, max_age_seconds: float) -> Optional[Dict]:
+        """Сохраненная сущность аккаунта, если она разрешена не раньше max_age_seconds назад"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT kind, entity_id, access_hash, title, username, megagroup, broadcast, left
+                FROM entity_cache
+                WHERE account = ? AND ref = ? AND resolved_at >= DATETIME('now', ?)
+            ''', (account, ref, f"-{int(max_age_seconds)} seconds"))
+            row = cursor.fetchone()
+            
+            conn.close()
+            if not row:
+                return None
+            return {
+                'kind': row[0],
+                'entity_id': row[1],
+                'access_hash': row[2],
+                'title': row[3],
+                'username': row[4],
+                'megagroup': bool(row[5]),
+                'broadcast': bool(row[6]),
+                'left': bool(row[7])
+            }
+    
+    def save_cached_entity(self, account: str, ref: str, fields: Dict):
+        """Сохраняет (или обновляет) разрешенную сущность аккаунта"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO entity_cache
+                    (account, ref, kind, entity_id, access_hash, title, username, megagroup, broadcast, left,
+                     resolved_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (account, ref, fields['kind'], fields['entity_id'], fields['access_hash'], fields['title'],
+                  fields['username'], fields['megagroup'], fields['broadcast'], fields.get('left', False)))
+            
+            conn.commit()
+            conn.close()
+    
+    def delete_cached_entity(self, account: str, ref: str):
+        """Удаляет сущность из кэша (например, если чат стал недоступен)"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM entity_cache WHERE account = ? AND ref = ?', (account, ref))
+            
+            conn.commit()
+            conn.close()
+    
     def add_chat_source(self, chat_id: str, chat_name: str = None, chat_type: str = None) -> bool:
         """Добавляет источник чата"""
         with self.lock:
@@ -464,6 +937,68 @@ class SharedDatabase:
                 conn.close()
                 return False
     
+    def get_active_chat_refs(self) -> List[str]:
+        """Ссылки активных источников чатов в порядке добавления"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT chat_id FROM chat_sources WHERE active = TRUE ORDER BY id')
+            refs = [row[0] for row in cursor.fetchall()]
+            
+            conn.close()
+            return refs
+    
+    def canonicalize_chat_source(self, ref: str, key: str, chat_name: str = None, chat_type: str = None) -> bool:
+        """
+        Переводит источник, добавленный по ссылке ref (@username, t.me/..., id),
+        на ключ key, под которым бот пишет статистику и курсор чата.
+        Если строка с key уже есть, строка ref удаляется, а флаг active
+        остается от строки key. Исходная ссылка сохраняется в source_ref:
+        чат без username (ключ chat_<id>) разрешается по приглашению.
+        Возвращает True, если чат под key активен
+        """
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT COALESCE(source_ref, chat_id) FROM chat_sources WHERE chat_id = ?', (ref,))
+            row = cursor.fetchone()
+            source_ref = row[0] if row else ref
+            
+            cursor.execute('SELECT 1 FROM chat_sources WHERE chat_id = ?', (key,))
+            if cursor.fetchone():
+                cursor.execute('DELETE FROM chat_sources WHERE chat_id = ?', (ref,))
+            else:
+                cursor.execute('UPDATE chat_sources SET chat_id = ? WHERE chat_id = ?', (key, ref))
+            # Приглашение важнее других ссылок: без него чат без username
+            # не разрешить аккаунту, у которого нет access_hash
+            cursor.execute('''
+                UPDATE chat_sources SET chat_name = COALESCE(?, chat_name), chat_type = COALESCE(?, chat_type),
+                                        source_ref = CASE WHEN source_ref IS NULL OR ? LIKE 'https://t.me/+%'
+                                                          THEN ? ELSE source_ref END
+                WHERE chat_id = ?
+            ''', (chat_name, chat_type, source_ref, source_ref, key))
+            
+            cursor.execute('SELECT active FROM chat_sources WHERE chat_id = ?', (key,))
+            row = cursor.fetchone()
+            
+            conn.commit()
+            conn.close()
+            return bool(row and row[0])
+    
+    def get_chat_source_ref(self, chat_id: str) -> Optional[str]:
+        """Ссылка, по которой был добавлен источник chat_id (None, если не сохранена)"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT source_ref FROM chat_sources WHERE chat_id = ?', (chat_id,))
+            row = cursor.fetchone()
+            
+            conn.close()
+            return row[0] if row else None
+    
     def remove_chat_source(self, chat_id: str) -> bool:
         """Удаляет источник чата"""
         with self.lock:
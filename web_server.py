@@ -6,12 +6,23 @@ from flask_socketio import SocketIO, emit
 
 # Импортируем общую базу данных
 from shared_db import db
+from keyword_matcher import KeywordIndex, live_keyword_matcher
+from lead_classifier import DEFAULT_MODEL_FILE, LeadClassifier
+from lead_scoring import live_lead_scorer
+from lemmatizer import Lemmatizer
 
 # Создаем Flask приложение
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+# Те же правила оценки и та же модель лидов, что и у бота
+with open("config.json", "r", encoding="utf-8") as f:
+    _CFG = json.load(f)
+scoring = live_lead_scorer(db, _CFG, LeadClassifier.load(_CFG.get("lead_model_file", DEFAULT_MODEL_FILE)))
+# И тот же автомат ключевых фраз: с natasha фразы ищутся и по леммам
+keywords = live_keyword_matcher(db, _CFG, Lemmatizer.from_config(_CFG))
+
 # Веб-маршруты
 @app.route('/')
 def dashboard():
@@ -26,6 +37,8 @@ def get_status():
         'telegram_connected': True,  # Можно проверить статус бота
         'ai_connected': bool(os.getenv("TOGETHER_API_KEY")),
         'monitoring_active': True,
+        # Ограничители отправки и аккаунты: сводку публикует процесс бота
+        'send_stats': db.get_setting('send_stats'),
         **stats
     })
 
@@ -83,6 +96,65 @@ def manage_keywords():
     keywords = db.get_keywords()
     return jsonify(keywords)
 
+@app.route('/api/negative-keywords', methods=['GET', 'POST', 'DELETE'])
+def manage_negative_keywords():
+    """API: Управление исключающими фразами"""
+    if request.method == 'POST':
+        # Добавить новую исключающую фразу
+        data = request.json
+        phrase = data.get('phrase', '').strip().lower()
+        
+        if phrase:
+            success = db.add_negative_keyword(phrase)
+            if success:
+                return jsonify({'status': 'success', 'message': 'Исключающая фраза добавлена'})
+            else:
+                return jsonify({'status': 'error', 'message': 'Такая исключающая фраза уже существует'})
+        
+        return jsonify({'status': 'error', 'message': 'Пустая исключающая фраза'})
+    
+    elif request.method == 'DELETE':
+        # Удалить исключающую фразу
+        phrase = request.args.get('phrase')
+        success = db.remove_negative_keyword(phrase)
+        if success:
+            return jsonify({'status': 'success', 'message': 'Исключающая фраза удалена'})
+        else:
+            return jsonify({'status': 'error', 'message': 'Исключающая фраза не найдена'})
+    
+    # Получить все исключающие фразы
+    return jsonify(db.get_negative_keywords())
+
+@app.route('/api/scoring-rules', methods=['GET', 'POST', 'DELETE'])
+def manage_scoring_rules():
+    """API: Управление правилами оценки лидов"""
+    if request.method == 'POST':
+        # Добавить или изменить правило
+        data = request.json
+        signal = data.get('signal', '').strip().lower()
+        
+        if not signal:
+            return jsonify({'status': 'error', 'message': 'Пустой сигнал'})
+        try:
+            points = int(data.get('points'))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Очки должны быть целым числом'})
+        
+        db.set_scoring_rule(signal, points, data.get('reason'), data.get('active', True))
+        return jsonify({'status': 'success', 'message': 'Правило сохранено'})
+    
+    elif request.method == 'DELETE':
+        # Удалить правило
+        signal = request.args.get('signal', '')
+        success = db.remove_scoring_rule(signal)
+        if success:
+            return jsonify({'status': 'success', 'message': 'Правило удалено'})
+        else:
+            return jsonify({'status': 'error', 'message': 'Правило не найдено'})
+    
+    # Получить все правила (включая выключенные)
+    return jsonify(db.get_scoring_rules(active_only=False))
+
 @app.route('/api/test-keyword', methods=['POST'])
 def test_keyword():
     """API: Тестирование ключевых слов"""
@@ -92,73 +164,23 @@ def test_keyword():
     if not message:
         return jsonify({'status': 'error', 'message': 'Сообщение не может быть пустым'})
     
-    # Тестируем совпадение
-    keywords = db.get_keywords()
-    hit = False
-    text_lower = message.lower()
-    
-    for phrase in keywords:
-        if phrase in text_lower:
-            hit = True
-            break
+    # Тестируем совпадение (исключающие фразы проверяются тем же проходом)
+    matches, excluded = KeywordIndex.split(keywords.get().find_all(message))
+    hit = bool(matches) and not excluded
     
-    # Анализируем качество (упрощенная версия)
-    quality = analyze_lead_quality_simple(message)
+    # Анализируем качество теми же правилами, что и бот
+    quality = scoring.score(message)
     
     return jsonify({
         'status': 'success',
         'hit': hit,
+        'matches': [m._asdict() for m in matches],
+        'excluded': [m._asdict() for m in excluded],
         'quality': quality,
-        'message': 'Совпадение найдено' if hit else 'Совпадений не найдено'
+        'message': ('Сообщение отброшено исключающей фразой' if excluded
+                    else 'Совпадение найдено' if hit else 'Совпадений не найдено')
     })
 
-def analyze_lead_quality_simple(text: str) -> dict:
-    """Упрощенный анализ качества лида"""
-    score = 0
-    reasons = []
-    text_lower = text.lower()
-    
-    # Положительные сигналы
-    positive = [
-        ("бюджет", 3, "💰 Упоминает бюджет"),
-        ("срочно", 2, "⚡ Срочная потребность"),
-        ("опытного", 2, "⭐ Ищет опытного"),
-        ("профессионал", 2, "⭐ Ищет профессионала"),
-    ]
-    
-    for signal, points, reason in positive:
-        if signal in text_lower:
-            score += points
-            reasons.append(reason)
-    
-    # Негативные сигналы
-    negative = [
-        ("бесплатно", -5, "🚫 Ищет бесплатно"),
-        ("дешево", -2, "💸 Ищет дешево"),
-        ("стажер", -2, "👶 Ищет стажера"),
-    ]
-    
-    for signal, points, reason in negative:
-        if signal in text_lower:
-            score += points
-            reasons.append(reason)
-    
-    # Определяем качество
-    if score >= 5:
-        quality = "🔥 ГОРЯЧИЙ ЛИД"
-    elif score >= 2:
-        quality = "🟡 ХОРОШИЙ ЛИД"
-    elif score >= 0:
-        quality = "🟢 ОБЫЧНЫЙ ЛИД"
-    else:
-        quality = "🔴 НИЗКОЕ КАЧЕСТВО"
-    
-    return {
-        "score": score,
-        "quality": quality,
-        "reasons": reasons
-    }
-
 @app.route('/api/chat-sources', methods=['GET', 'POST', 'DELETE'])
 def manage_chat_sources():
     """API: Управление источниками чатов"""